@@ -0,0 +1,130 @@
+"""
+Times SalesChartDataframeCreator.make_sales_chart_input_df (one fused groupby) against the
+multi-pass composition it replaced, and checks both return the same frame. From the repo root:
+
+    python -m benchmarks.bench_sales_chart_input
+    python -m benchmarks.bench_sales_chart_input --source raw --copies 10 --repeat 5
+
+--copies stacks the benchmark group with offset address_ids to stand in for a larger group.
+"""
+import argparse
+import timeit
+import warnings
+import pandas as pd
+from charts.chart_tools import SalesChartDataframeCreator
+from data_loaders.calendar_columns import PERIOD_TO_YEAR_COLNAME_DICT, SELECTBOX_TO_COLNAME_DICT
+from data_loaders.registry import get_calendar_dimension, load_store_attributes, load_stores_data
+from data_loaders.rollups import load_rollup_data
+
+
+SALES_COLUMNS = ['address_id', 'finance_department_nm', 'promotion_ind', 'warehouse', 'sales_qty', 'sales_ex_gst',
+                 'gp_ex_gst', 'prom_wk_end_dt', 'prom_year_wk_num', 'prom_mth_num', 'prom_month_nm', 'prom_year_num',
+                 'lped_qtr_nm', 'lped_year_num']
+
+
+# The previous make_sales_chart_input_df and the SalesChartDataframeCreator helper methods it was
+# built from, kept here as the reference the fused version is checked against
+
+def make_groupby_period_df(df_period, df, metric, periodicity, year_col_name, agg_method):
+    df_agg = df.groupby([periodicity, year_col_name], observed=True)[metric].sum().reset_index()
+    if agg_method == 'Average per Store':
+        store_count = len(df['address_id'].unique())
+        df_agg[metric] = round(df_agg[metric] / store_count, 2)
+    df_agg_final = pd.merge(
+        df_period, df_agg, how='left', on=[periodicity, year_col_name]
+    ).sort_values([year_col_name, periodicity], ascending=[True, True])
+    return df_agg_final
+
+
+def make_pct_total_df(df, metric, periodicity, year_col_name, indicator_column, agg_method):
+    df_total = df.groupby([periodicity, year_col_name], observed=True)[metric].sum().reset_index()
+    if agg_method == 'Average per Store':
+        store_count = len(df['address_id'].unique())
+        df_total[metric] = round(df_total[metric] / store_count, 2)
+    df_total = df_total.rename(columns={metric: 'metric_total'})
+
+    df_indicator = df[df[indicator_column] == 'Y'].groupby([periodicity, year_col_name], observed=True)[metric].sum().reset_index()
+    if agg_method == 'Average per Store':
+        store_count = len(df['address_id'].unique())
+        df_indicator[metric] = round(df_indicator[metric] / store_count, 2)
+
+    df_ratio = pd.merge(df_total, df_indicator, how='outer', on=[periodicity, year_col_name])
+    df_ratio[f'{indicator_column} {metric} ratio'] = round(df_ratio[metric] / df_ratio['metric_total'], 4)
+    df_ratio = df_ratio.drop([metric, 'metric_total'], axis=1)
+    return df_ratio
+
+
+def make_gp_pct_df(df_period, df, periodicity, year_col_name, agg_method):
+    df_gp_agg = df.groupby([periodicity, year_col_name], observed=True)[['gp_ex_gst', 'sales_ex_gst']].sum().reset_index()
+    if agg_method == 'Average per Store':
+        store_count = len(df['address_id'].unique())
+        df_gp_agg[['gp_ex_gst', 'sales_ex_gst']] = round(df_gp_agg[['gp_ex_gst', 'sales_ex_gst']] / store_count, 2)
+    df_gp_agg['gp_pct'] = df_gp_agg['gp_ex_gst'] / df_gp_agg['sales_ex_gst']
+    # Joined with the period calendar to make sure new stores will display all the time axis
+    df_gp_agg_final = pd.merge(
+        df_period, df_gp_agg, how='left', on=[periodicity, year_col_name]
+    )[[periodicity, year_col_name, 'gp_pct']].sort_values([year_col_name, periodicity], ascending=[True, True])
+    return df_gp_agg_final
+
+
+def make_sales_chart_input_df_multi_pass(scdc, df, metric, st_ss_periodicity, st_ss_agg_method):
+    # Four helper calls (six groupbys) joined by three merges
+    periodicity = SELECTBOX_TO_COLNAME_DICT[st_ss_periodicity]
+    year_col_name = PERIOD_TO_YEAR_COLNAME_DICT[periodicity]
+    df_period = scdc.df_period[periodicity]
+    return make_groupby_period_df(df_period, df, metric, periodicity, year_col_name, agg_method=st_ss_agg_method).merge(
+        make_pct_total_df(df, metric, periodicity, year_col_name, indicator_column='warehouse', agg_method=st_ss_agg_method),
+        on=[periodicity, year_col_name], how='left'
+    ).merge(
+        make_gp_pct_df(df_period, df, periodicity, year_col_name, agg_method=st_ss_agg_method),
+        on=[periodicity, year_col_name], how='left'
+    ).merge(
+        make_pct_total_df(df, metric, periodicity, year_col_name, indicator_column='promotion_ind', agg_method=st_ss_agg_method),
+        on=[periodicity, year_col_name], how='left'
+    )
+
+
+def stack_store_copies(df, copies):
+    address_offset = int(df['address_id'].max()) + 1
+    return pd.concat([df.assign(address_id=df['address_id'] + i * address_offset) for i in range(copies)], ignore_index=True)
+
+
+def load_input(source, address_ids, st_ss_periodicity):
+    if source == 'rollup':
+        return load_rollup_data('sales_gp_units', address_ids, st_ss_periodicity)
+    return load_stores_data('sales_gp_units', address_ids, SALES_COLUMNS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the fused Sales/GP/Units chart aggregation.")
+    parser.add_argument('--source', choices=['rollup', 'raw'], default='rollup', help="Rollup rows (what the tab reads) or raw weekly rows")
+    parser.add_argument('--copies', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--metric', default='sales_ex_gst', choices=['sales_ex_gst', 'gp_ex_gst', 'sales_qty'])
+    args = parser.parse_args()
+
+    address_ids = load_store_attributes()['address_id'].unique().tolist()
+    print(f"{'periodicity':<16}{'agg method':<20}{'rows':>10}{'multi pass ms':>15}{'fused ms':>10}{'speedup':>9}")
+    for st_ss_periodicity in SELECTBOX_TO_COLNAME_DICT:
+        df = stack_store_copies(load_input(args.source, address_ids, st_ss_periodicity), args.copies)
+        scdc = SalesChartDataframeCreator(get_calendar_dimension('sales_gp_units'))
+        for st_ss_agg_method in ['Average per Store', 'Sum of Stores']:
+            df_old = make_sales_chart_input_df_multi_pass(scdc, df, args.metric, st_ss_periodicity, st_ss_agg_method)
+            df_new = scdc.make_sales_chart_input_df(df, args.metric, st_ss_periodicity, st_ss_agg_method)
+            pd.testing.assert_frame_equal(df_old.reset_index(drop=True), df_new, check_exact=True)
+
+            old_s = min(timeit.repeat(
+                lambda: make_sales_chart_input_df_multi_pass(scdc, df, args.metric, st_ss_periodicity, st_ss_agg_method),
+                number=1, repeat=args.repeat
+            ))
+            new_s = min(timeit.repeat(
+                lambda: scdc.make_sales_chart_input_df(df, args.metric, st_ss_periodicity, st_ss_agg_method),
+                number=1, repeat=args.repeat
+            ))
+            print(f"{st_ss_periodicity:<16}{st_ss_agg_method:<20}{len(df):>10}{old_s * 1000:>15.1f}{new_s * 1000:>10.1f}{old_s / new_s:>8.1f}x")
+
+
+if __name__ == '__main__':
+    # st.cache_resource warns when used outside `streamlit run`
+    warnings.filterwarnings('ignore')
+    main()
@@ -1,54 +1,102 @@
+import numpy as np
 import pandas as pd
-import plotly.express as px
+import plotly.graph_objects as go
+from data_loaders.calendar_columns import MONTH_NAME_TO_NUM
 
-def store_bubble_chart(df_target, df_benchmark, df_stores, metric, metric_renamed):
-    if df_target['address_id'].values[0] not in df_benchmark['address_id'].unique():
-        df = pd.concat([df_benchmark, df_target])
-    else:
-        df = df_benchmark
 
-    df = df.sort_values(['address_id', 'prom_wk_end_dt'], ascending=True)
+def make_store_bubble_chart_df(df_monthly, target_address_id, store_index, metric, metric_renamed):
+    """
+    Each store's metric per calendar month, with its name, size, metric per sqm and whether it's
+    the target store. df_monthly holds one row per store and month (StoreWeekTotals.monthly_sums()),
+    so the attribute merge, labels and per sqm values only touch one row per store and month.
+    """
+    df = df_monthly
 
-    df = df.merge(df_stores, on='address_id', how='inner')
+    # Only the attributes the chart uses, for only the stores in it (a store missing either is left out)
+    df_stores = store_index.attributes(df['address_id'].unique(), ['address_id', 'Store Name', 'Store Size'])
+    df = df.merge(df_stores.dropna(subset=['Store Name', 'Store Size']), on='address_id', how='inner')
 
-    df['year_month_dt'] = pd.to_datetime(df['prom_month_nm'].astype(str) + '-' + df['prom_year_num'].astype(str))
-    df['Calendar Month'] = df['year_month_dt'].dt.strftime('%B-%y')
-    df = df.groupby(['address_id', 'Store Name', 'Store Size', 'year_month_dt', 'Calendar Month'])[metric].sum().reset_index()
-    df['Target or Benchmark'] = df['address_id'].apply(lambda x: 'Target Store' if x == df_target['address_id'].values[0] else 'Benchmark Store')
+    month_nums = df['prom_month_nm'].astype(str).map(MONTH_NAME_TO_NUM)
+    df['year_month_dt'] = pd.to_datetime(pd.DataFrame({'year': df['prom_year_num'], 'month': month_nums, 'day': 1}))
+    df = df.sort_values(['address_id', 'year_month_dt'], ignore_index=True)
+    # Formatted once per month rather than once per row
+    month_dts = df['year_month_dt'].unique()
+    df['Calendar Month'] = df['year_month_dt'].map(pd.Series(pd.DatetimeIndex(month_dts).strftime('%B-%y'), index=month_dts))
 
-    def calc_metric_per_sqm(metric, store_size):
-        if (metric > 0) and (store_size > 0):
-            return round(metric / store_size, 2)
-        else:
-            return 0.001
+    df['Target or Benchmark'] = np.where(df['address_id'] == target_address_id, 'Target Store', 'Benchmark Store')
+    metric_values, store_sizes = df[metric].to_numpy(dtype='float64'), df['Store Size'].to_numpy(dtype='float64')
+    has_metric_per_sqm = (metric_values > 0) & (store_sizes > 0)
+    df[f'{metric_renamed} per sqm'] = np.where(
+        has_metric_per_sqm, np.round(metric_values / np.where(has_metric_per_sqm, store_sizes, 1), 2), 0.001
+    )
+    return df.rename(columns={metric: metric_renamed})
 
-    df[f'{metric_renamed} per sqm'] = df[[metric, 'Store Size']].apply(lambda x: calc_metric_per_sqm(*x), axis=1)
-    
-    df = df.rename(columns={metric: metric_renamed})
-    # df = df.sort_values(['address_id', 'Calendar Month'])
 
-    fig = px.scatter(
-        data_frame=df,
-        x="Store Size",
-        y=metric_renamed,
-        size=f"{metric_renamed} per sqm",
-        size_max=30,
-        hover_name="Store Name",
-        animation_frame="Calendar Month",
-        color="Target or Benchmark",
-        color_discrete_sequence=["rgb(50, 150, 255)", "rgb(255, 128, 0)",],
-        # trendline="ols",
-        range_x=[min(df['Store Size']) * 0.95, max(df['Store Size']) * 1.05],
-        range_y=[min(df[metric_renamed]) * 0.95, max(df[metric_renamed]) * 1.05],
-    )
+def store_bubble_chart(df_monthly, target_address_id, store_index, metric, metric_renamed, max_months=None):
+    """
+    Animated by calendar month, built as one trace per store group whose points are the group's
+    stores in a fixed order. Store names, sizes, colours and the hovertemplate are set once on the
+    traces; each frame only carries the month's metric and per sqm arrays (a gap where a store
+    has no sales that month). max_months keeps only the latest months.
+    """
+    df = make_store_bubble_chart_df(df_monthly, target_address_id, store_index, metric, metric_renamed)
+    size_col = f'{metric_renamed} per sqm'
+    month_dts = np.sort(df['year_month_dt'].unique())
+    if max_months is not None:
+        month_dts = month_dts[-max_months:]
+        df = df[df['year_month_dt'].isin(month_dts)]
+    month_labels = df.drop_duplicates('year_month_dt').set_index('year_month_dt')['Calendar Month'].loc[month_dts].tolist()
 
-    fig.update_traces(
-        hovertemplate="<b>%{hovertext}</b><br>" + \
-            f"{metric_renamed}: %{{y:$.3s}}" + "<br>" + \
-            "Store Size: %{x}m2" + "<br>" + \
-            f"{metric_renamed} per sqm: %{{marker.size:$.0f}} per m<sup>2</sup>",
-    )
+    hovertemplate = "<b>%{hovertext}</b><br>" + \
+        f"{metric_renamed}: %{{y:$.3s}}" + "<br>" + \
+        "Store Size: %{x}m2" + "<br>" + \
+        f"{metric_renamed} per sqm: %{{marker.size:$.0f}} per m<sup>2</sup>"
+
+    # Store group -> its stores' (metric, per sqm) by month
+    store_groups = [
+        ('Benchmark Store', "rgb(50, 150, 255)"),
+        ('Target Store', "rgb(255, 128, 0)"),
+    ]
+    traces, group_values = [], []
+    for group, color in store_groups:
+        df_group = df[df['Target or Benchmark'] == group]
+        df_stores = df_group.drop_duplicates('address_id')
+        df_values = df_group.pivot(index='address_id', columns='year_month_dt', values=[metric_renamed, size_col]).reindex(
+            index=df_stores['address_id'], columns=pd.MultiIndex.from_product([[metric_renamed, size_col], month_dts])
+        )
+        group_values.append((df_values[metric_renamed].round(2).to_numpy().T, df_values[size_col].to_numpy().T))
+        traces.append(
+            go.Scatter(
+                name=group,
+                x=df_stores['Store Size'].to_numpy(),
+                y=group_values[-1][0][0],
+                hovertext=df_stores['Store Name'].to_numpy(),
+                mode='markers',
+                marker=dict(size=group_values[-1][1][0], color=color, sizemode='area'),
+                hovertemplate=hovertemplate,
+            )
+        )
+
+    # The same bubble scale as plotly express' size_max=30
+    max_size = np.nanmax(df[size_col].to_numpy()) if len(df) else 1
+    for trace in traces:
+        trace.marker.sizeref = max_size / (30 ** 2)
 
+    frames = [
+        go.Frame(
+            name=month_label,
+            traces=list(range(len(traces))),
+            data=[go.Scatter(y=metric_values[i], marker=dict(size=sizes[i])) for metric_values, sizes in group_values],
+        )
+        for i, month_label in enumerate(month_labels)
+    ]
+
+    fig = go.Figure(data=traces, frames=frames)
+
+    frame_args = lambda duration: dict(
+        frame=dict(duration=duration, redraw=False), mode="immediate", fromcurrent=True,
+        transition=dict(duration=duration, easing="linear"),
+    )
     fig.update_layout(
         title=f"{metric_renamed} per m<sup>2</sup>",
         height=500,
@@ -56,26 +104,31 @@ def store_bubble_chart(df_target, df_benchmark, df_stores, metric, metric_rename
             title="Store Size (m<sup>2</sup>)",
             titlefont=dict(size=15),
             tickfont_size=15,
+            range=[min(df['Store Size']) * 0.95, max(df['Store Size']) * 1.05],
         ),
         yaxis=dict(
             title=None,
             titlefont=dict(size=15),
             tickfont_size=15,
             tickformat="$,.2s",
+            range=[min(df[metric_renamed]) * 0.95, max(df[metric_renamed]) * 1.05],
         ),
-        showlegend=False
+        showlegend=False,
+        updatemenus=[dict(
+            type="buttons", direction="left", showactive=False,
+            x=0.1, xanchor="right", y=0, yanchor="top", pad=dict(r=10, t=70),
+            buttons=[
+                dict(label="&#9654;", method="animate", args=[None, frame_args(666)]),
+                dict(label="&#9724;", method="animate", args=[[None], frame_args(0)]),
+            ],
+        )],
+        sliders=[dict(
+            active=0, x=0.1, len=0.9, xanchor="left", y=0, yanchor="top", pad=dict(b=10, t=60),
+            currentvalue=dict(prefix="Calendar Month="),
+            steps=[
+                dict(label=frame.name, method="animate", args=[[frame.name], frame_args(0)])
+                for frame in frames
+            ],
+        )],
     )
-
-    fig.layout.updatemenus[0].buttons[0].args[1]['frame']['duration'] = 666
-    fig.layout.updatemenus[0].buttons[0].args[1]['frame']['transition'] = 666
-
-    # Must include this section to update each new frame with the desired hovertemplate
-    for f in fig.frames:
-        for data in f.data:
-            data.update(
-                hovertemplate="<b>%{hovertext}</b><br>" + \
-                f"{metric_renamed}: %{{y:$.3s}}" + "<br>" + \
-                "Store Size: %{x}m2" + "<br>" + \
-                f"{metric_renamed} per sqm: %{{marker.size:$.0f}} per m<sup>2</sup>"
-            )
     return fig
@@ -1,5 +1,10 @@
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+from data_loaders.calendar_columns import (
+    PERIOD_TO_YEAR_COLNAME_DICT, SELECTBOX_TO_COLNAME_DICT, parse_year_col_name, period_codes
+)
 
 
 COLOR_SCHEME = ["rgb(133, 133, 166)", # 2019
@@ -9,136 +14,173 @@ COLOR_SCHEME = ["rgb(133, 133, 166)", # 2019
                 "rgb(255, 128, 0)"] # 2023
 
 
-SELECTBOX_TO_COLNAME_DICT = {
-    'YoY - Quarterly': 'lped_qtr_nm',
-    'YoY - Monthly': 'prom_mth_num',
-    'YoY - Weekly': 'prom_year_wk_num',
-    'Quarterly': 'lped_qtr_yr_dt',
-    'Monthly': 'prom_mth_yr_dt',
-    'Weekly': 'prom_wk_end_dt',
-}
+SALES_MEASURES = ['sales_ex_gst', 'gp_ex_gst', 'sales_qty']
+BASKET_METRICS = ['store_baskets', 'store_avg_basket_size', 'store_avg_basket_value']
 
 
-class ChartCalendarDates:
-    def __init__(self, df_benchmark_stores):
-        self.df_qtrs_yoy = df_benchmark_stores[['lped_qtr_nm', 'lped_year_num']].drop_duplicates()
-        self.df_months_yoy = df_benchmark_stores[['prom_mth_num', 'prom_year_num']].drop_duplicates()
-        self.df_wk_nums_yoy = df_benchmark_stores[['prom_year_wk_num', 'prom_year_num']].drop_duplicates()
-        self.df_qtrly = df_benchmark_stores[['lped_qtr_yr_dt', 'lped_year_num']].drop_duplicates()
-        self.df_monthly = df_benchmark_stores[['prom_mth_yr_dt', 'prom_year_num']].drop_duplicates()
-        self.df_wk_start_dts = df_benchmark_stores[['prom_wk_end_dt', 'prom_year_num']].drop_duplicates()
-        self.df_period = {
-            'lped_qtr_nm': self.df_qtrs_yoy,
-            'prom_mth_num': self.df_months_yoy,
-            'prom_year_wk_num': self.df_wk_nums_yoy,
-            'lped_qtr_yr_dt': self.df_qtrly,
-            'prom_mth_yr_dt': self.df_monthly,
-            'prom_wk_end_dt': self.df_wk_start_dts
-        }
+# Fast rendering - line timeseries longer than this are drawn with WebGL from their LTTB points
+FAST_RENDER_MAX_POINTS = 150
 
 
-class SalesChartDataframeCreator(ChartCalendarDates):
+def lttb_indices(y, n_out):
     """
-    TODO - 
-    Should I make the methods much simpler? i.e. only create the specific dataframe needed 
-    rather than all this convoluted shit where the last method acts like main().
-    Add a method that parses the parameters and runs the required method.
-    Shorten code here but will lengthen code in spawn chart 🙃🤔
+    Largest-Triangle-Three-Buckets over evenly spaced points: the positions of n_out points of y
+    that keep the series' shape (peaks and troughs survive, flat runs thin out). The first and
+    last points are always kept.
     """
-    def __init__(self, df_benchmark_stores):
-        super().__init__(df_benchmark_stores)
-        
-    def make_groupby_period_df(self, df, metric, periodicity, year_col_name, agg_method):
-        df_agg = df.groupby([periodicity, year_col_name])[metric].sum().reset_index()
-        if agg_method == 'Average per Store':
-            store_count = len(df['address_id'].unique())
-            df_agg[metric] = round(df_agg[metric] / store_count, 2)
-        df_agg_final = pd.merge(
-            self.df_period[periodicity], df_agg, how='left', on=[periodicity, year_col_name]
-        ).sort_values([year_col_name, periodicity], ascending=[True, True])
-        return df_agg_final
-    
-    def make_pct_total_df(self, df, metric, periodicity, year_col_name, indicator_column, agg_method):
-        df_total = df.groupby([periodicity, year_col_name])[metric].sum().reset_index()
-        if agg_method == 'Average per Store':
-            store_count = len(df['address_id'].unique())
-            df_total[metric] = round(df_total[metric] / store_count, 2)
-        df_total = df_total.rename(columns={metric: 'metric_total'})
-
-        df_indicator = df[df[indicator_column] == 'Y'].groupby([periodicity, year_col_name])[metric].sum().reset_index()
-        if agg_method == 'Average per Store':
-            store_count = len(df['address_id'].unique())
-            df_indicator[metric] = round(df_indicator[metric] / store_count, 2)
-
-        df_ratio = pd.merge(df_total, df_indicator, how='outer', on=[periodicity, year_col_name])
-        df_ratio[f'{indicator_column} {metric} ratio'] = round(df_ratio[metric] / df_ratio['metric_total'], 4)
-        df_ratio = df_ratio.drop([metric, 'metric_total'], axis=1)
-        return df_ratio
-    
-    def make_gp_pct_df(self, df, periodicity, year_col_name, agg_method):
-        df_gp_agg = df.groupby([periodicity, year_col_name])[['gp_ex_gst', 'sales_ex_gst']].sum().reset_index()
-        if agg_method == 'Average per Store':
-            store_count = len(df['address_id'].unique())
-            df_gp_agg[['gp_ex_gst', 'sales_ex_gst']] = round(df_gp_agg[['gp_ex_gst', 'sales_ex_gst']] / store_count, 2)
-        df_gp_agg['gp_pct'] = df_gp_agg['gp_ex_gst'] / df_gp_agg['sales_ex_gst']
-        # Joined with DF_QTRS to make sure new stores will display all the time axis
-        df_gp_agg_final = pd.merge(
-            self.df_period[periodicity], df_gp_agg, how='left', on=[periodicity, year_col_name]
-        )[[periodicity, year_col_name, 'gp_pct']].sort_values([year_col_name, periodicity], ascending=[True, True])
-        return df_gp_agg_final
-    
+    y = np.asarray(y, dtype='float64')
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    # n_out - 2 buckets between the first and last points
+    bucket_edges = np.linspace(1, n - 1, n_out - 1).astype('int64')
+    indices = np.empty(n_out, dtype='int64')
+    indices[0], indices[-1] = 0, n - 1
+    prev = 0
+    for i in range(n_out - 2):
+        start, end = bucket_edges[i], bucket_edges[i + 1]
+        next_end = bucket_edges[i + 2] if i + 2 < len(bucket_edges) else n
+        next_y = y[end:next_end]
+        next_y = next_y[~np.isnan(next_y)]
+        avg_x = (end + next_end - 1) / 2
+        avg_y = next_y.mean() if len(next_y) else y[prev]
+        bucket_x = np.arange(start, end)
+        areas = np.abs((prev - avg_x) * (y[start:end] - y[prev]) - (prev - bucket_x) * (avg_y - y[prev]))
+        # Gaps (NaN) are only picked when the whole bucket is a gap
+        prev = start + int(np.argmax(np.nan_to_num(areas, nan=-1.0)))
+        indices[i + 1] = prev
+    return indices
+
+
+class ChartCalendarDates:
+    def __init__(self, calendar_dimension):
+        # periodicity -> distinct (period, year) rows, from data_loaders.registry.get_calendar_dimension()
+        self.df_period = calendar_dimension
+
+    def period_calendar(self, periodicity):
+        # The calendar rows indexed by period code, in chart order - reindexing an aggregate by
+        # period code onto this labels it and fills in the periods without any rows
+        df_period = self.df_period[periodicity]
+        return df_period.set_index(period_codes(df_period, periodicity)).sort_index()
+
+
+class SalesChartDataframeCreator(ChartCalendarDates):
+    def __init__(self, calendar_dimension):
+        super().__init__(calendar_dimension)
+
     def make_sales_chart_input_df(self, df, metric, st_ss_periodicity, st_ss_agg_method):
+        return self.select_measure(
+            self.make_sales_chart_input_wide_df(df, st_ss_periodicity, st_ss_agg_method, measures=[metric]),
+            metric, st_ss_periodicity
+        )
+
+    def make_sales_chart_input_wide_df(self, df, st_ss_periodicity, st_ss_agg_method, measures=SALES_MEASURES, df_active_stores=None):
+        """
+        Every measure with its warehouse and promo share, plus GP%, per period in one groupby. The
+        shares sum the measure masked to the 'Y' rows (min_count=1 keeps a period without any as
+        NaN), which gives the same numbers as separate groupbys and merges per measure and share
+        (benchmarks/bench_sales_chart_input.py keeps that version as a reference). select_measure()
+        picks out one measure's chart input.
+        """
         periodicity = SELECTBOX_TO_COLNAME_DICT[st_ss_periodicity]
-        if 'lped_' in periodicity:
-            year_col_name = 'lped_year_num'
-        else:
-            year_col_name = 'prom_year_num'
-        df_chart = self.make_groupby_period_df(df, metric, periodicity, year_col_name, agg_method=st_ss_agg_method).merge(
-            self.make_pct_total_df(df, metric, periodicity, year_col_name, indicator_column='warehouse', agg_method=st_ss_agg_method), 
-            on=[periodicity, year_col_name], how='left'
-        ).merge(
-            self.make_gp_pct_df(df, periodicity, year_col_name, agg_method=st_ss_agg_method),
-            on=[periodicity, year_col_name], how='left'
-        ).merge(
-            self.make_pct_total_df(df, metric, periodicity, year_col_name, indicator_column='promotion_ind', agg_method=st_ss_agg_method), 
-            on=[periodicity, year_col_name], how='left'
+        is_warehouse = df['warehouse'] == 'Y'
+        is_promotion = df['promotion_ind'] == 'Y'
+        sums = {measure: df[measure] for measure in dict.fromkeys(list(measures) + ['gp_ex_gst', 'sales_ex_gst'])}
+        for measure in measures:
+            sums[f'warehouse_{measure}'] = df[measure].where(is_warehouse)
+            sums[f'promotion_ind_{measure}'] = df[measure].where(is_promotion)
+        df_sums = pd.DataFrame(sums).groupby(period_codes(df, periodicity)).sum(min_count=1)
+        store_count = len(df['address_id'].unique())
+        return self.make_sales_chart_input_df_from_code_sums(
+            df_sums, store_count, measures, st_ss_periodicity, st_ss_agg_method, df_active_stores
         )
-        return df_chart
 
+    def make_sales_chart_input_df_from_sums(self, df_sums, store_count, measures, st_ss_periodicity, st_ss_agg_method,
+                                            df_active_stores=None):
+        """
+        Finishes the wide chart input from per period sums - from make_sales_chart_input_wide_df() or
+        the duckdb backend. df_sums holds each measure, warehouse_<measure> and promotion_ind_<measure>
+        (the measure summed over the 'Y' rows, NaN for a period with none), gp_ex_gst and sales_ex_gst.
+        'Average per Active Store' needs df_active_stores from make_active_store_count_df().
+        """
+        periodicity = SELECTBOX_TO_COLNAME_DICT[st_ss_periodicity]
+        year_col_name = PERIOD_TO_YEAR_COLNAME_DICT[periodicity]
+        df_period = self.df_period[periodicity]
+        df_sums = df_sums.astype({periodicity: df_period[periodicity].dtype, year_col_name: df_period[year_col_name].dtype})
+        df_code_sums = df_sums.drop(columns=[periodicity, year_col_name]).set_axis(period_codes(df_sums, periodicity))
+        return self.make_sales_chart_input_df_from_code_sums(
+            df_code_sums, store_count, measures, st_ss_periodicity, st_ss_agg_method, df_active_stores
+        )
 
-class BasketsChartDataframeCreator(ChartCalendarDates):
-    def __init__(self, df_benchmark_stores):
-        super().__init__(df_benchmark_stores)
+    def make_sales_chart_input_df_from_code_sums(self, df_sums, store_count, measures, st_ss_periodicity, st_ss_agg_method,
+                                                 df_active_stores=None):
+        # As make_sales_chart_input_df_from_sums(), with df_sums indexed by period_codes() in place of the period columns
+        periodicity = SELECTBOX_TO_COLNAME_DICT[st_ss_periodicity]
+        df_calendar = self.period_calendar(periodicity)
+        if st_ss_agg_method == 'Average per Store':
+            df_sums = round(df_sums / store_count, 2)
+        elif st_ss_agg_method == 'Average per Active Store':
+            # Each period over the stores trading in it, so stores opening or closing don't skew history
+            df_sums = round(df_sums.div(df_active_stores.reindex(df_sums.index), axis=0), 2)
+        df_sums = df_sums.reindex(df_calendar.index)
+        chart_cols = {}
+        for measure in measures:
+            chart_cols[measure] = df_sums[measure]
+            chart_cols[f'warehouse {measure} ratio'] = round(df_sums[f'warehouse_{measure}'] / df_sums[measure], 4)
+            chart_cols[f'promotion_ind {measure} ratio'] = round(df_sums[f'promotion_ind_{measure}'] / df_sums[measure], 4)
+        chart_cols['gp_pct'] = df_sums['gp_ex_gst'] / df_sums['sales_ex_gst']
+        return pd.concat([df_calendar, pd.DataFrame(chart_cols)], axis=1).reset_index(drop=True)
 
-    def make_basket_chart_df(self, df, metric, st_ss_periodicity):
-        self.periodicity = SELECTBOX_TO_COLNAME_DICT[st_ss_periodicity]
-        if 'lped_' in self.periodicity:
-            self.year_col_name = 'lped_year_num'
-        else:
-            self.year_col_name = 'prom_year_num'
+    @staticmethod
+    def make_active_store_count_df(df, st_ss_periodicity):
+        # Stores with any rows in each period, indexed by period code - pass the store group's rows
+        # before the Settings filters
+        periodicity = SELECTBOX_TO_COLNAME_DICT[st_ss_periodicity]
+        return df['address_id'].groupby(period_codes(df, periodicity)).nunique().rename('active_store_count')
 
-        # if metric == 'store_baskets':
-        #     df = df.groupby([self.periodicity, self.year_col_name])[metric].sum().reset_index()
-        # else:
-        #     df = round(df.groupby([self.periodicity, self.year_col_name])[metric].mean().reset_index(), 2)
+    @staticmethod
+    def select_measure(df_chart, metric, st_ss_periodicity):
+        # One measure's columns out of the wide chart input, in the order the charts expect
+        periodicity = SELECTBOX_TO_COLNAME_DICT[st_ss_periodicity]
+        year_col_name = PERIOD_TO_YEAR_COLNAME_DICT[periodicity]
+        return df_chart[[
+            periodicity, year_col_name, metric, f'warehouse {metric} ratio', 'gp_pct', f'promotion_ind {metric} ratio'
+        ]]
 
-        df = round(df.groupby([self.periodicity, self.year_col_name])[metric].mean().reset_index(), 2)
-        df = pd.merge(
-            self.df_period[self.periodicity], df, how='left', on=[self.periodicity, self.year_col_name]
-        ).sort_values([self.year_col_name, self.periodicity], ascending=[True, True])
-        return df
 
-    def make_basket_chart_input_df(self, df, st_ss_periodicity):
-        col_name_list = ['store_baskets', 'store_avg_basket_size', 'store_avg_basket_value']
-        dfs = [self.make_basket_chart_df(df, col_name, st_ss_periodicity) for col_name in col_name_list]
-        dfs = [df.set_index([self.periodicity, self.year_col_name]) for df in dfs]
-        return dfs[0].join(dfs[1:], how='inner').reset_index()
+class BasketsChartDataframeCreator(ChartCalendarDates):
+    def __init__(self, calendar_dimension):
+        super().__init__(calendar_dimension)
+
+    def make_basket_chart_input_df(self, df, st_ss_periodicity, weighted=False):
+        """
+        All basket metrics per period in one groupby. By default each is the mean of the store
+        averages; weighted=True divides total items and total value by total baskets instead, so
+        every basket counts the same whichever store it was in.
+        """
+        periodicity = SELECTBOX_TO_COLNAME_DICT[st_ss_periodicity]
+        codes = period_codes(df, periodicity)
+        if weighted:
+            df_agg = df.assign(
+                basket_items=df['store_avg_basket_size'] * df['store_baskets'],
+                basket_value=df['store_avg_basket_value'] * df['store_baskets'],
+            ).groupby(codes).agg(
+                store_baskets=('store_baskets', 'mean'),
+                total_baskets=('store_baskets', 'sum'),
+                basket_items=('basket_items', 'sum'),
+                basket_value=('basket_value', 'sum'),
+            )
+            df_agg['store_avg_basket_size'] = df_agg['basket_items'] / df_agg['total_baskets']
+            df_agg['store_avg_basket_value'] = df_agg['basket_value'] / df_agg['total_baskets']
+            df_agg = df_agg[BASKET_METRICS]
+        else:
+            df_agg = df[BASKET_METRICS].groupby(codes).mean()
+        df_calendar = self.period_calendar(periodicity)
+        return pd.concat([df_calendar, round(df_agg, 2).reindex(df_calendar.index)], axis=1).reset_index(drop=True)
 
 
 class Charts:
-    def __init__(self, color_scheme=COLOR_SCHEME):
-        self.color_scheme_list = color_scheme
-        
+    # Helpers shared by the figure builders below
     @staticmethod
     def create_x_axis(df, st_ss_periodicity):
         if st_ss_periodicity == 'YoY - Monthly':
@@ -150,311 +192,283 @@ class Charts:
         return x_axis
     
     @staticmethod
-    def parse_year_col_name(st_ss_periodicity):
-        if 'Quarterly' in st_ss_periodicity:
-            return 'lped_year_num'
-        else:
-            return 'prom_year_num'
-        
-    def make_barchart_yoy(self, df, metric, metric_renamed, st_ss_periodicity):
-        self.metric = metric
-        self.metric_renamed = metric_renamed
-        self.st_ss_periodicity = st_ss_periodicity
-        year_col_name = self.parse_year_col_name(st_ss_periodicity)
-        self.years = df[year_col_name].unique()
-        self.x_axis = self.create_x_axis(df, st_ss_periodicity)
-        self.fig = go.Figure()
-        for year, bar_color in zip(self.years, self.color_scheme_list):
-            name = f"{year} {metric_renamed}"
-            if metric in ['sales_qty', 'store_baskets', 'store_avg_basket_size']:
-                hovertemplate = f"{name}: %{{y:.3s}}<extra></extra>"
-            else:
-                hovertemplate = f"{name}: %{{y:$.3s}}<extra></extra>"
-            y_axis = df[df[year_col_name] == year][metric]
-            self.fig.add_trace(
-                go.Bar(
-                    name=name,
-                    x=self.x_axis,
-                    y=y_axis,
-                    marker_color=bar_color,
-                    hovertemplate=hovertemplate
-                )
-            )
-        return self
-              
-    def make_ratio_linechart_yoy(self, df, metric, metric_renamed, st_ss_periodicity, indicator='gp_pct'):
-        self.indicator = indicator
-        self.metric_renamed = metric_renamed
-        self.st_ss_periodicity = st_ss_periodicity
-        year_col_name = self.parse_year_col_name(st_ss_periodicity)
-        self.years = df[year_col_name].unique()
-        self.x_axis = self.create_x_axis(df, st_ss_periodicity)
-        self.fig = go.Figure()
-        for year, line_color in zip(self.years, self.color_scheme_list):
-            name = f"{year} {metric_renamed}"
-            if indicator == 'gp_pct':
-                self.indicator_renamed = 'GP%'
-                name = f"{year} GP%"
-                y_axis = df[df[year_col_name] == year]['gp_pct']
-                hovertemplate = f"{name}: %{{y:.1%}}<extra></extra>"
-                line_shape = "hvh"
-            else:
-                indicator_dict = {'warehouse': 'Warehouse', 'promotion_ind': 'Promotions'}
-                self.indicator_renamed = indicator_dict[indicator]
-                name = f"{year} % {self.indicator_renamed}"
-                y_axis = df[df[year_col_name] == year][f'{indicator} {metric} ratio']
-                hovertemplate = f"{name}: %{{y:.1%}}<extra></extra>"
-                line_shape = "linear"
-
-            self.fig.add_trace(
-                go.Scatter(
-                    name=name,
-                    x=self.x_axis,
-                    y=y_axis,
-                    marker_color=line_color,
-                    mode="lines+markers",
-                    line_shape=line_shape,
-                    hovertemplate = hovertemplate,
-                )
-            )
-        return self
+    def fast_render_points(x_axis, y_axis, decimals):
+        # The LTTB points of a long series, rounded by compact_values()
+        y_axis = np.asarray(y_axis, dtype='float64')
+        indices = lttb_indices(y_axis, FAST_RENDER_MAX_POINTS)
+        return np.asarray(x_axis)[indices], Charts.compact_values(y_axis[indices], decimals)
 
-    def make_barchart_timeseries(self, df, metric, metric_renamed, st_ss_periodicity):
-        self.metric = metric
-        self.metric_renamed = metric_renamed
-        self.st_ss_periodicity = st_ss_periodicity
-        self.x_axis = self.create_x_axis(df, st_ss_periodicity)
-        y_axis = df[metric]
-        name=f"{st_ss_periodicity} {metric_renamed}"
+    @staticmethod
+    def compact_values(y_axis, decimals):
+        # plotly 5.14 sends trace arrays as JSON number lists - it has no typed array encoding - so
+        # the only payload saving is rounding to what the hover shows, leaving fewer digits per value
+        return np.round(np.asarray(y_axis, dtype='float64'), decimals)
+
+
+# ------------------------------ Figure Builders ------------------------------ #
+# Each takes the chart input and its parameters and returns the styled figure, keeping nothing
+# between calls - so a target store and a benchmark group chart can be built on separate threads.
+
+def make_barchart_yoy(df, metric, metric_renamed, st_ss_periodicity, color_scheme=COLOR_SCHEME):
+    year_col_name = parse_year_col_name(st_ss_periodicity)
+    years = df[year_col_name].unique()
+    x_axis = Charts.create_x_axis(df, st_ss_periodicity)
+    fig = go.Figure()
+    for year, bar_color in zip(years, color_scheme):
+        name = f"{year} {metric_renamed}"
         if metric in ['sales_qty', 'store_baskets', 'store_avg_basket_size']:
             hovertemplate = f"{name}: %{{y:.3s}}<extra></extra>"
         else:
             hovertemplate = f"{name}: %{{y:$.3s}}<extra></extra>"
-        self.fig = go.Figure()    
-        self.fig.add_trace(
+        y_axis = df[df[year_col_name] == year][metric]
+        fig.add_trace(
             go.Bar(
-                x=self.x_axis,
+                name=name,
+                x=x_axis,
                 y=y_axis,
+                marker_color=bar_color,
                 hovertemplate=hovertemplate
             )
         )
-        return self
-                
-    def make_linechart_timeseries(self, df, metric, metric_renamed, st_ss_periodicity):
-        self.x_axis = self.create_x_axis(df, st_ss_periodicity)
-        y_axis = df[metric]
-        self.fig = go.Figure()    
-        self.fig.add_trace(
-            go.Scatter(
-                name=f"{st_ss_periodicity} {metric_renamed}",
-                x=self.x_axis,
-                y=y_axis,
-                mode="lines",
-                line_shape="spline",
-                hovertemplate=f"{metric_renamed}: %{{y:$.3s}}<extra></extra>"
-            )
-        )
-        self.fig.update_layout(
-            height=233,
-            title=f"{metric_renamed} - {st_ss_periodicity}",
-            yaxis_title=f"{metric_renamed}",
-            xaxis=dict(tickfont_size=16),
-            yaxis=dict(
-                tickfont_size=16,
-                tickformat="$,.3s",
-                showspikes=True,
-            ),
-            hovermode="x unified",
-            margin=dict(t=33, b=33),
-        )
-        return self
-    
-    
-    def make_ratio_linechart_timeseries(self, df, metric, st_ss_periodicity, indicator='gp_pct'):
-        self.x_axis = self.create_x_axis(df, st_ss_periodicity)
-        self.fig = go.Figure()
+
+    if metric in ['sales_qty', 'store_baskets', 'store_avg_basket_size']:
+        y_tickformat = ",.0s"
+    else:
+        y_tickformat = "$,.0s"
+    fig.update_layout(
+        height=233,
+        title=f"{metric_renamed} - {st_ss_periodicity}",
+        yaxis_title=metric_renamed,
+        hovermode="x unified",
+        margin=dict(t=33, b=33),
+        xaxis=dict(
+            tickfont_size=16,
+            tickvals=x_axis,
+            tickformat="%b",
+            color="#C0C0C0",
+        ),
+        yaxis=dict(
+            tickfont_size=16,
+            tickformat=y_tickformat
+        ),
+        barmode="group",
+        bargap=0.1, # gap between bars of adjacent location coordinates.
+        bargroupgap=0.05 # gap between bars of the same location coordinate.
+    )
+    return fig
+
+
+def make_ratio_linechart_yoy(df, metric, metric_renamed, st_ss_periodicity, indicator='gp_pct', color_scheme=COLOR_SCHEME):
+    year_col_name = parse_year_col_name(st_ss_periodicity)
+    years = df[year_col_name].unique()
+    x_axis = Charts.create_x_axis(df, st_ss_periodicity)
+    if indicator == 'gp_pct':
+        indicator_renamed = 'GP%'
+    else:
+        indicator_dict = {'warehouse': 'Warehouse', 'promotion_ind': 'Promotions'}
+        indicator_renamed = indicator_dict[indicator]
+    fig = go.Figure()
+    for year, line_color in zip(years, color_scheme):
         if indicator == 'gp_pct':
-            indicator_renamed = 'GP%'
-            y_axis = df['gp_pct']
-            hovertemplate = f"GP%: %{{y:.1%}}<extra></extra>"
+            name = f"{year} GP%"
+            y_axis = df[df[year_col_name] == year]['gp_pct']
+            hovertemplate = f"{name}: %{{y:.1%}}<extra></extra>"
             line_shape = "hvh"
-            title=f"{indicator_renamed} - {st_ss_periodicity}"
         else:
-            indicator_dict = {'warehouse': 'Warehouse', 'promotion_ind': 'Promotions'}
-            indicator_renamed = indicator_dict[indicator]
-            y_axis = df[f'{indicator} {metric} ratio']
-            hovertemplate = f"% {indicator_renamed}: %{{y:.1%}}<extra></extra>"
+            name = f"{year} % {indicator_renamed}"
+            y_axis = df[df[year_col_name] == year][f'{indicator} {metric} ratio']
+            hovertemplate = f"{name}: %{{y:.1%}}<extra></extra>"
             line_shape = "linear"
-            title=f"% {indicator_renamed} - {st_ss_periodicity}"
-            
 
-        self.fig.add_trace(
+        fig.add_trace(
             go.Scatter(
-                x=self.x_axis,
+                name=name,
+                x=x_axis,
                 y=y_axis,
+                marker_color=line_color,
                 mode="lines+markers",
                 line_shape=line_shape,
                 hovertemplate = hovertemplate,
             )
         )
-        self.fig.update_layout(
-            height=233,
-            title=title,
-            yaxis_title=f"{indicator_renamed}",
-            xaxis=dict(tickfont_size=16),
-            yaxis=dict(
-                tickfont_size=16,
-                tickformat=",.1%",
-                showspikes=True,
-            ),
-            hovermode="x unified",
-            margin=dict(t=33, b=33),
-        )
-        return self
-                
-    
-    def make_linechart_timeseries(self, df, metric, metric_renamed, st_ss_periodicity, indicator=None):
-        self.x_axis = self.create_x_axis(df, st_ss_periodicity)
-        if indicator is None:
-            y_axis = df[metric]
-            if metric in ['sales_qty', 'store_baskets']:
-                y_tickformat = ",.3s"
-            else:
-                y_tickformat = "$,.3s"
-            hovertemplate=f"{metric_renamed}: %{{y:{y_tickformat}}}<extra></extra>"
-            line_shape="spline"
-            title=f"{metric_renamed} - {st_ss_periodicity}"
-            yaxis_title=f"{metric_renamed}"
-        elif indicator == 'gp_pct':
-            y_axis = df['gp_pct']
-            y_tickformat=",.0%"
-            indicator_renamed = 'GP%'
-            hovertemplate = f"GP%: %{{y:.1%}}<extra></extra>"
-            line_shape = "hvh"
-            title=f"{indicator_renamed} - {st_ss_periodicity}"
-            yaxis_title=f"{indicator_renamed}"
-        else:
-            y_axis = df[f'{indicator} {metric} ratio']
-            y_tickformat=",.0%"
-            indicator_dict = {'warehouse': 'Warehouse', 'promotion_ind': 'Promotions'}
-            indicator_renamed = indicator_dict[indicator]
-            hovertemplate = f"% {indicator_renamed}: %{{y:.1%}}<extra></extra>"
-            line_shape = "spline"
-            title=f"% {indicator_renamed} - {st_ss_periodicity}"
-            yaxis_title=f"{indicator_renamed}"
-        
-        self.fig = go.Figure()  
-        self.fig.add_trace(
-            go.Scatter(
-                x=self.x_axis,
-                y=y_axis,
-                mode="lines",
-                line_shape=line_shape,
-                hovertemplate = hovertemplate,
-            )
-        )
-        self.fig.update_layout(
-            height=233,
-            title=title,
-            yaxis_title=yaxis_title,
-            xaxis=dict(tickfont_size=16),
-            yaxis=dict(
-                tickfont_size=16,
-                tickformat=y_tickformat,
-                showspikes=True,
-            ),
-            hovermode="x unified",
-            margin=dict(t=33, b=33),
+
+    if indicator == 'gp_pct':
+        title = f"{indicator_renamed} - {st_ss_periodicity}"
+        yaxis_title = f"{indicator_renamed}"
+    else:            
+        title = f"% {indicator_renamed} - {st_ss_periodicity}"
+        yaxis_title = f"% {indicator_renamed}"  
+    fig.update_layout(
+        height=233,
+        title=title,
+        yaxis_title=yaxis_title,
+        hovermode="x unified",
+        margin=dict(t=33, b=33),
+        xaxis=dict(
+            tickfont_size=16,
+            tickvals=x_axis,
+            tickformat="%b",
+            color="#C0C0C0",
+        ),
+        yaxis=dict(
+            tickfont_size=16,
+            tickformat=",.0%",
         )
-        return self
+    )
+    return fig
 
 
-class ChartMaker(Charts):
-    def __init__(self):
-        super().__init__(color_scheme=COLOR_SCHEME)
-        
-    def format_barchart_yoy(self):
-        if self.metric in ['sales_qty', 'store_baskets', 'store_avg_basket_size']:
-            y_tickformat = ",.0s"
-        else:
-            y_tickformat = "$,.0s"
-        self.fig.update_layout(
-            height=233,
-            title=f"{self.metric_renamed} - {self.st_ss_periodicity}",
-            yaxis_title=self.metric_renamed,
-            hovermode="x unified",
-            margin=dict(t=33, b=33),
-            xaxis=dict(
-                tickfont_size=16,
-                tickvals=self.x_axis,
-                tickformat="%b",
-                color="#C0C0C0",
-            ),
-            yaxis=dict(
-                tickfont_size=16,
-                tickformat=y_tickformat
-            ),
-            barmode="group",
-            bargap=0.1, # gap between bars of adjacent location coordinates.
-            bargroupgap=0.05 # gap between bars of the same location coordinate.
-        )
-        return self.fig
-    
-    def format_ratio_linechart_yoy(self):
-        if self.indicator == 'gp_pct':
-            title = f"{self.indicator_renamed} - {self.st_ss_periodicity}"
-            yaxis_title = f"{self.indicator_renamed}"
-        else:            
-            title = f"% {self.indicator_renamed} - {self.st_ss_periodicity}"
-            yaxis_title = f"% {self.indicator_renamed}"  
-        self.fig.update_layout(
-            height=233,
-            title=title,
-            yaxis_title=yaxis_title,
-            hovermode="x unified",
-            margin=dict(t=33, b=33),
-            xaxis=dict(
-                tickfont_size=16,
-                tickvals=self.x_axis,
-                tickformat="%b",
-                color="#C0C0C0",
-            ),
-            yaxis=dict(
-                tickfont_size=16,
-                tickformat=",.0%",
-            )
+def make_barchart_timeseries(df, metric, metric_renamed, st_ss_periodicity, fast_render=False):
+    x_axis = Charts.create_x_axis(df, st_ss_periodicity)
+    y_axis = df[metric]
+    # plotly has no WebGL bars, and each bar is a whole period's total, so a long series keeps
+    # every period and is only rounded - sampling the bars would drop weeks from the chart
+    if fast_render and len(y_axis) > FAST_RENDER_MAX_POINTS:
+        y_axis = Charts.compact_values(y_axis, decimals=2)
+    name=f"{st_ss_periodicity} {metric_renamed}"
+    if metric in ['sales_qty', 'store_baskets', 'store_avg_basket_size']:
+        hovertemplate = f"{name}: %{{y:.3s}}<extra></extra>"
+    else:
+        hovertemplate = f"{name}: %{{y:$.3s}}<extra></extra>"
+    fig = go.Figure()    
+    fig.add_trace(
+        go.Bar(
+            x=x_axis,
+            y=y_axis,
+            hovertemplate=hovertemplate
         )
-        return self.fig
+    )
 
-    def format_barchart_timeseries(self):
-        if self.metric in ['sales_qty', 'store_baskets', 'store_avg_basket_size']:
-            y_tickformat = ",.0s"
-        else:
-            y_tickformat = "$,.0s"
+    if metric in ['sales_qty', 'store_baskets', 'store_avg_basket_size']:
+        y_tickformat = ",.0s"
+    else:
+        y_tickformat = "$,.0s"
+
+    if st_ss_periodicity == 'Weekly':
+        x_tickformat = "%Y-%b-%d"
+        x_tickvals = None
+    else:
+        x_tickformat = "%b-%Y"
+        x_tickvals = x_axis
+
+    fig.update_layout(
+        height=233,
+        title=f"{metric_renamed} - {st_ss_periodicity}",
+        yaxis_title=f"{metric_renamed}",
+        xaxis=dict(
+            tickfont_size=16,
+            tickvals=x_tickvals,
+            tickformat=x_tickformat,
+            color="#C0C0C0",
+        ),
+        yaxis=dict(
+            tickfont_size=16,
+            tickformat=y_tickformat,
+            showspikes=True,
+        ),
+        hovermode="x unified",
+        margin=dict(t=33, b=33),
+    )
+    return fig
 
-        if self.st_ss_periodicity == 'Weekly':
-            x_tickformat = "%Y-%b-%d"
-            x_tickvals = None
+
+def make_linechart_timeseries(df, metric, metric_renamed, st_ss_periodicity, indicator=None, fast_render=False):
+    x_axis = Charts.create_x_axis(df, st_ss_periodicity)
+    if indicator is None:
+        y_axis = df[metric]
+        decimals = 2
+        if metric in ['sales_qty', 'store_baskets']:
+            y_tickformat = ",.3s"
         else:
-            x_tickformat = "%b-%Y"
-            x_tickvals = self.x_axis
-
-        self.fig.update_layout(
-            height=233,
-            title=f"{self.metric_renamed} - {self.st_ss_periodicity}",
-            yaxis_title=f"{self.metric_renamed}",
-            xaxis=dict(
-                tickfont_size=16,
-                tickvals=x_tickvals,
-                tickformat=x_tickformat,
-                color="#C0C0C0",
-            ),
-            yaxis=dict(
-                tickfont_size=16,
-                tickformat=y_tickformat,
-                showspikes=True,
-            ),
-            hovermode="x unified",
-            margin=dict(t=33, b=33),
+            y_tickformat = "$,.3s"
+        hovertemplate=f"{metric_renamed}: %{{y:{y_tickformat}}}<extra></extra>"
+        line_shape="spline"
+        title=f"{metric_renamed} - {st_ss_periodicity}"
+        yaxis_title=f"{metric_renamed}"
+    elif indicator == 'gp_pct':
+        y_axis = df['gp_pct']
+        decimals = 4
+        y_tickformat=",.0%"
+        indicator_renamed = 'GP%'
+        hovertemplate = f"GP%: %{{y:.1%}}<extra></extra>"
+        line_shape = "hvh"
+        title=f"{indicator_renamed} - {st_ss_periodicity}"
+        yaxis_title=f"{indicator_renamed}"
+    else:
+        y_axis = df[f'{indicator} {metric} ratio']
+        decimals = 4
+        y_tickformat=",.0%"
+        indicator_dict = {'warehouse': 'Warehouse', 'promotion_ind': 'Promotions'}
+        indicator_renamed = indicator_dict[indicator]
+        hovertemplate = f"% {indicator_renamed}: %{{y:.1%}}<extra></extra>"
+        line_shape = "spline"
+        title=f"% {indicator_renamed} - {st_ss_periodicity}"
+        yaxis_title=f"{indicator_renamed}"
+
+    scatter = go.Scatter
+    if fast_render and len(y_axis) > FAST_RENDER_MAX_POINTS:
+        x_axis, y_axis = Charts.fast_render_points(x_axis, y_axis, decimals)
+        scatter = go.Scattergl
+        # WebGL lines can't be splines
+        if line_shape == "spline":
+            line_shape = "linear"
+
+    fig = go.Figure()  
+    fig.add_trace(
+        scatter(
+            x=x_axis,
+            y=y_axis,
+            mode="lines",
+            line_shape=line_shape,
+            hovertemplate = hovertemplate,
         )
-        return self.fig
+    )
+    fig.update_layout(
+        height=233,
+        title=title,
+        yaxis_title=yaxis_title,
+        xaxis=dict(tickfont_size=16),
+        yaxis=dict(
+            tickfont_size=16,
+            tickformat=y_tickformat,
+            showspikes=True,
+        ),
+        hovermode="x unified",
+        margin=dict(t=33, b=33),
+    )
+    return fig
+
+
+def combine_figures(figs, panel_height=233):
+    """
+    Stacks single chart figures (from the builders above) into one figure with a shared, linked x
+    axis - one plotly_chart call per view instead of one per chart. Each panel keeps its own y
+    axis styling and its figure's title as the panel title. The figures passed in aren't modified.
+    """
+    fig = make_subplots(
+        rows=len(figs), cols=1, shared_xaxes=True, vertical_spacing=0.2 / len(figs),
+        subplot_titles=[sub_fig.layout.title.text for sub_fig in figs],
+    )
+    for row, sub_fig in enumerate(figs, start=1):
+        for trace in sub_fig.data:
+            # The years repeat down the panels in the same colours, so only the top panel's go in the legend
+            fig.add_trace(trace, row=row, col=1)
+            if row > 1:
+                fig.data[-1].showlegend = False
+        fig.update_yaxes(sub_fig.layout.yaxis, row=row, col=1)
+    x_layout = figs[0].layout.xaxis
+    fig.update_xaxes(
+        tickfont_size=x_layout.tickfont.size, tickvals=x_layout.tickvals, tickformat=x_layout.tickformat,
+        color=x_layout.color,
+        # A spike line through every panel links the hover across them
+        showspikes=True, spikemode='across', spikesnap='cursor', spikethickness=1,
+    )
+    bar_layout = next((sub_fig.layout for sub_fig in figs if sub_fig.layout.barmode), None)
+    if bar_layout is not None:
+        fig.update_layout(barmode=bar_layout.barmode, bargap=bar_layout.bargap, bargroupgap=bar_layout.bargroupgap)
+    fig.update_layout(
+        height=panel_height * len(figs),
+        hovermode="x unified",
+        margin=dict(t=33, b=33),
+    )
+    return fig
@@ -0,0 +1,73 @@
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from charts.chart_tools import (
+    combine_figures, make_barchart_timeseries, make_barchart_yoy, make_linechart_timeseries, make_ratio_linechart_yoy
+)
+from utils.lru_cache import LRUCache
+
+
+FIGURE_CACHE_MAX_ENTRIES = 128
+
+# Chart name -> the builder that makes its styled figure
+CHART_FIGURE_BUILDERS = {
+    'barchart_yoy': make_barchart_yoy,
+    'ratio_linechart_yoy': make_ratio_linechart_yoy,
+    'barchart_timeseries': make_barchart_timeseries,
+    'linechart_timeseries': make_linechart_timeseries,
+}
+
+
+def dataframe_fingerprint(df):
+    # Content hash of the chart input - values, index, column names and dtypes
+    fingerprint = hashlib.sha1(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    fingerprint.update(repr([(col, str(dtype)) for col, dtype in df.dtypes.items()]).encode())
+    return fingerprint.hexdigest()
+
+
+@st.cache_resource(show_spinner=False)
+def get_figure_cache():
+    return LRUCache(max_entries=FIGURE_CACHE_MAX_ENTRIES)
+
+
+def chart_figure(df, df_fingerprint, chart_spec):
+    # chart_spec is (chart, args, sorted kwargs items), which keys the figure along with the input's fingerprint
+    chart, args, kwargs = chart_spec
+    return get_figure_cache().get_or_compute(
+        (df_fingerprint, chart_spec), lambda: CHART_FIGURE_BUILDERS[chart](df, *args, **dict(kwargs))
+    )
+
+
+def cached_chart_figures(df, chart_specs, combined=False):
+    """
+    The styled figures for a view's charts over df, top to bottom. chart_specs holds a
+    (chart, args, kwargs) per figure, chart being a CHART_FIGURE_BUILDERS key. A figure is reused
+    when any session has already built it from the same input and parameters, so a rerun for an
+    unrelated widget skips the trace loops, styling and plotly validation. combined=True returns
+    them as one figure of stacked panels (combine_figures()). Figures are shared, don't modify
+    them in place.
+    """
+    df_fingerprint = dataframe_fingerprint(df)
+    chart_specs = tuple((chart, tuple(args), tuple(sorted(kwargs.items()))) for chart, args, kwargs in chart_specs)
+    if not combined:
+        return [chart_figure(df, df_fingerprint, chart_spec) for chart_spec in chart_specs]
+    return [get_figure_cache().get_or_compute(
+        (df_fingerprint, 'combined', chart_specs),
+        lambda: combine_figures([chart_figure(df, df_fingerprint, chart_spec) for chart_spec in chart_specs])
+    )]
+
+
+def build_concurrently(*builds):
+    """
+    Runs each zero argument build on its own thread and returns their results in order - the
+    target store and benchmark group aggregations and figures of a compare view take the longer
+    of the two instead of their sum. The threads get the session's script context, so cached
+    loaders and session_state reads work, but builds mustn't draw anything - return figures and
+    plot them afterwards. An exception in a build is raised here.
+    """
+    ctx = get_script_run_ctx()
+    with ThreadPoolExecutor(max_workers=len(builds), initializer=add_script_run_ctx, initargs=(None, ctx)) as executor:
+        futures = [executor.submit(build) for build in builds]
+        return [future.result() for future in futures]
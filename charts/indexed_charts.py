@@ -1,27 +1,49 @@
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
+from data_loaders.calendar_columns import week_end_dates
 
 
-def create_df_indexed_metric(df, metric, metric_renamed, st_ss_agg_method, cumsum=False):
-    if st_ss_agg_method == 'Sum of Stores':
-        df = df.groupby('prom_wk_end_dt')[metric].sum().reset_index()
-    elif st_ss_agg_method == 'Average per Store':
-        df = df.groupby('prom_wk_end_dt')[metric].mean().reset_index()
-    df = df.rename(columns={'prom_wk_end_dt': 'Week', metric: metric_renamed})
-    df = df.sort_values(['Week'], ascending=True)
+def make_df_indexed_metrics(store_week_totals, measures, st_ss_agg_method, active_store_counts=None):
+    """
+    Each measure's weekly value with its indexed and cumulative indexed versions (both start at
+    100 in the first week), reduced over the stores of a StoreWeekTotals for all the measures at
+    once. Average per Store averages over the weekly department rows, Average per Active Store
+    divides by active_store_counts (StoreWeekCube.active_store_counts()). select_indexed_metric()
+    picks out one measure's chart input.
+    """
+    # Only the weeks with rows left after the filters
+    week_row_counts = store_week_totals.row_counts.sum(axis=0)
+    weeks = week_row_counts > 0
+    week_codes = store_week_totals.week_codes[weeks]
+    values = np.column_stack(
+        [np.nansum(store_week_totals.totals[measure][:, weeks], axis=0) for measure in measures]
+    ).reshape(len(week_codes), len(measures))
+    if st_ss_agg_method == 'Average per Store':
+        values = values / week_row_counts[weeks][:, None]
+    elif st_ss_agg_method == 'Average per Active Store':
+        values = values / active_store_counts.reindex(week_codes).to_numpy(dtype='float64')[:, None]
 
+    cum_values = values.cumsum(axis=0)
+    # Indexed starting value = 100 (raises IndexError when no rows are left after the filters)
+    indexed = np.round(values / values[0] * 100, 0).astype(int)
+    cum_indexed = np.round(cum_values / cum_values[0] * 100, 0).astype(int)
+
+    indexed_cols = {'Week': week_end_dates(week_codes)}
+    for i, measure in enumerate(measures):
+        indexed_cols[measure] = values[:, i]
+        indexed_cols[f'{measure} indexed'] = indexed[:, i]
+        indexed_cols[f'{measure} cumulative indexed'] = cum_indexed[:, i]
+    return pd.DataFrame(indexed_cols)
+
+
+def select_indexed_metric(df_indexed, metric, metric_renamed, cumsum=False):
+    # One measure's indexed (or cumulative indexed) series, named the way indexed_comps_chart() labels it
     if cumsum is True:
-        # Cumulative Sum - Index starting value = 100
-        df['Cum Sum'] = df[metric_renamed].cumsum()
-        idx_val = df['Cum Sum'].values[0]
-        df[f'Cumulative {metric_renamed} Indexed'] = df['Cum Sum'].apply(lambda x: round((x/idx_val * 100), 0)).astype(int)
-        df = df.drop('Cum Sum', axis=1)
-    else:
-        # Indexed starting value = 100
-        idx_val = df[metric_renamed].values[0]
-        df[f'{metric_renamed} Indexed'] = df[metric_renamed].apply(lambda x: round((x/idx_val * 100), 0)).astype(int)
-    
-    return df.drop(metric_renamed, axis=1)
+        return df_indexed[['Week', f'{metric} cumulative indexed']].rename(
+            columns={f'{metric} cumulative indexed': f'Cumulative {metric_renamed} Indexed'}
+        )
+    return df_indexed[['Week', f'{metric} indexed']].rename(columns={f'{metric} indexed': f'{metric_renamed} Indexed'})
 
 
 def indexed_comps_chart(df_target, df_benchmark):
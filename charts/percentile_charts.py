@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+from data_loaders.calendar_columns import week_end_dates
+
+
+def percentile_ranks(target_values, benchmark_matrix):
+    """
+    Percentile rank (0-100) of each week's target value among that week's benchmark values -
+    the share of benchmark stores below it, counting ties as half. NaN where either side has no
+    value.
+    """
+    valid = ~np.isnan(benchmark_matrix)
+    n_valid = valid.sum(axis=0)
+    below = (valid & (benchmark_matrix < target_values)).sum(axis=0)
+    ties = (valid & (benchmark_matrix == target_values)).sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ranks = (below + 0.5 * ties) / n_valid * 100
+    return np.where(np.isnan(target_values) | (n_valid == 0), np.nan, ranks)
+
+
+def make_df_percentile_ranks(target_totals, benchmark_totals, measures):
+    """
+    The target store's weekly percentile rank among the benchmark stores for every measure, plus
+    how many benchmark stores traded each week, from two StoreWeekTotals over the same weeks. The
+    target store is left out of the benchmark side when it's part of the group.
+    """
+    benchmark_totals = benchmark_totals.stores(np.setdiff1d(benchmark_totals.address_ids, target_totals.address_ids))
+    weeks = (target_totals.row_counts.sum(axis=0) > 0) | (benchmark_totals.row_counts.sum(axis=0) > 0)
+    benchmark_has_rows = benchmark_totals.row_counts[:, weeks] > 0
+
+    rank_cols = {'Week': week_end_dates(target_totals.week_codes[weeks])}
+    for measure in measures:
+        rank_cols[f'{measure} percentile'] = percentile_ranks(
+            target_totals.totals[measure][0, weeks], benchmark_totals.totals[measure][:, weeks]
+        )
+    rank_cols['benchmark_store_count'] = benchmark_has_rows.sum(axis=0)
+    return pd.DataFrame(rank_cols)
+
+
+def percentile_rank_chart(df_ranks, metric, metric_renamed):
+    fig = go.Figure()
+    # Quartile guides - the middle half of the benchmark group sits between the dotted lines
+    for percentile, dash in [(25, 'dot'), (50, 'dash'), (75, 'dot')]:
+        fig.add_hline(y=percentile, line_dash=dash, line_color="#C0C0C0", line_width=1)
+    fig.add_trace(
+        go.Scatter(
+            name=f"Target Store {metric_renamed} Percentile",
+            x=df_ranks['Week'],
+            y=df_ranks[f'{metric} percentile'],
+            customdata=df_ranks['benchmark_store_count'],
+            mode='lines',
+            line_shape='spline',
+            marker_color='rgb(255, 128, 0)',
+            hovertemplate=f"{metric_renamed} Percentile: %{{y:.0f}} of %{{customdata}} stores<extra></extra>",
+        )
+    )
+    fig.update_layout(
+        height=333,
+        title=f"Target Store {metric_renamed} Percentile in Benchmark Group - Weekly",
+        xaxis=dict(tickfont_size=16),
+        yaxis=dict(
+            tickfont_size=16,
+            range=[0, 100],
+        ),
+        hovermode='x unified',
+        showlegend=False,
+        margin=dict(t=33, b=33),
+    )
+    return fig
@@ -0,0 +1,34 @@
+import hashlib
+import streamlit as st
+from data_loaders.registry import list_partitions
+from utils.lru_cache import LRUCache
+
+
+BENCHMARK_CACHE_MAX_ENTRIES = 256
+
+
+def benchmark_set_key(address_ids):
+    """
+    Order independent identity for a group of stores. The AgGrid hands the selected rows back in
+    whatever order the grid is in, so the same benchmark group can arrive as different lists.
+    """
+    canonical_ids = ','.join(str(address_id) for address_id in sorted({int(address_id) for address_id in address_ids}))
+    return hashlib.sha1(canonical_ids.encode()).hexdigest()
+
+
+@st.cache_resource(show_spinner=False)
+def get_benchmark_aggregate_cache():
+    return LRUCache(max_entries=BENCHMARK_CACHE_MAX_ENTRIES)
+
+
+def cached_benchmark_aggregate(name, dataset, benchmark_key, params, compute):
+    """
+    Returns compute() for this (aggregate name, benchmark group, params), reusing the result when
+    any session or tab has already computed it. params must be hashable and cover every setting the
+    aggregate depends on. Results are shared - don't modify them in place.
+
+    The key includes the dataset's partitions, so appending a week to a dataset retires only the
+    aggregates computed from that dataset (they age out of the LRU) and leaves the others in place.
+    """
+    key = (name, dataset, list_partitions(dataset), benchmark_key, params)
+    return get_benchmark_aggregate_cache().get_or_compute(key, compute)
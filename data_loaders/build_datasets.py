@@ -0,0 +1,101 @@
+"""
+Data preparation step for the weekly parquet files. Run from the repo root after the weekly
+extracts land in data/:
+
+    python -m data_loaders.build_datasets
+    python -m data_loaders.build_datasets --datasets baskets sales_profile --stores-per-row-group 8
+
+Every dataset data_loaders.ingest_week appends to is covered, store_attributes included, so no
+dataset's increments are left to pile up as partitions.
+
+Each dataset is rewritten with its calendar columns materialised (typed prom_wk_end_dt,
+prom_mth_yr_dt, lped_qtr_yr_dt), sorted by address_id, then prom_wk_end_dt, with every row group
+holding a fixed number of whole stores. The row group min/max statistics on address_id then
+tell the registry exactly which row groups hold the stores in a benchmark, so a read only
+decodes those stores instead of scanning the whole file.
+
+Weeks appended since the last build (data_loaders.ingest_week) are folded into the rebuilt file
+and their increment files removed.
+"""
+import argparse
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from data_loaders.calendar_columns import add_calendar_columns
+from data_loaders.registry import DATA_DIR, encode_dimensions, dataset_path, list_increment_paths
+
+
+STORE_DATASETS = ['sales_gp_units', 'baskets', 'sales_profile', 'store_attributes']
+STORES_PER_ROW_GROUP = 16
+
+
+def prepare_table(df):
+    """
+    Materialises the calendar columns, dictionary encodes the dimension columns and sorts by
+    store, then week (on the parsed date, not the text).
+    """
+    df = add_calendar_columns(df.reset_index(drop=True))
+    df = df.sort_values(['address_id', 'prom_wk_end_dt'], kind='stable', ignore_index=True)
+    # Written as dictionary columns, so they load straight back as categoricals
+    df = encode_dimensions(df)
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def store_row_group_bounds(table, stores_per_row_group):
+    # Row offsets where a new block of stores starts, so no store is split across row groups
+    address_ids = table['address_id'].to_numpy()
+    store_starts = np.flatnonzero(np.r_[True, address_ids[1:] != address_ids[:-1]])
+    bounds = store_starts[::stores_per_row_group].tolist() + [table.num_rows]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def write_store_row_groups(table, target, stores_per_row_group=STORES_PER_ROW_GROUP):
+    tmp_target = target + '.tmp'
+    with pq.ParquetWriter(tmp_target, table.schema, compression='snappy') as writer:
+        for start, end in store_row_group_bounds(table, stores_per_row_group):
+            writer.write_table(table.slice(start, end - start), row_group_size=end - start)
+    # Swapped in whole, so the app never reads a half written file
+    os.replace(tmp_target, target)
+
+
+def build_dataset(dataset, data_dir=DATA_DIR, output_dir=DATA_DIR, stores_per_row_group=STORES_PER_ROW_GROUP):
+    source = dataset_path(dataset, data_dir)
+    if not os.path.exists(source):
+        print(f"Skipping {dataset} - {source} not found")
+        return None
+    increment_paths = list_increment_paths(dataset, data_dir)
+    # Calendar columns are added per file first - increments already carry them, an unbuilt source doesn't
+    df = pd.concat(
+        [add_calendar_columns(pq.read_table(path).to_pandas()) for path in [source] + increment_paths], ignore_index=True
+    )
+    table = prepare_table(df)
+
+    target = dataset_path(dataset, output_dir)
+    write_store_row_groups(table, target, stores_per_row_group)
+    if os.path.abspath(target) == os.path.abspath(source):
+        for path in increment_paths:
+            os.remove(path)
+
+    row_groups = pq.ParquetFile(target).metadata.num_row_groups
+    print(f"Built {target} - {table.num_rows} rows, {row_groups} row groups, {len(increment_paths)} appended weeks folded in")
+    return target
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rewrite the weekly parquet files sorted and row-grouped by address_id.")
+    parser.add_argument('--datasets', nargs='+', choices=STORE_DATASETS, default=STORE_DATASETS)
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--output-dir', default=None, help="Defaults to rewriting the files in --data-dir")
+    parser.add_argument('--stores-per-row-group', type=int, default=STORES_PER_ROW_GROUP)
+    args = parser.parse_args()
+
+    output_dir = args.output_dir or args.data_dir
+    os.makedirs(output_dir, exist_ok=True)
+    for dataset in args.datasets:
+        build_dataset(dataset, args.data_dir, output_dir, args.stores_per_row_group)
+
+
+if __name__ == '__main__':
+    main()
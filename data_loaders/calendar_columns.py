@@ -0,0 +1,86 @@
+import calendar
+import numpy as np
+import pandas as pd
+
+
+MONTH_NAME_TO_NUM = {month_nm: month_num for month_num, month_nm in enumerate(calendar.month_name) if month_nm}
+
+# Period keys derived from the raw prom/lped columns. The build step writes these into the
+# parquet files, otherwise the registry adds them once per store block when it is first loaded.
+CALENDAR_COLUMNS = ['prom_mth_num', 'prom_mth_yr_dt', 'lped_qtr_yr_dt']
+
+# Periodicity selectbox -> its period column
+SELECTBOX_TO_COLNAME_DICT = {
+    'YoY - Quarterly': 'lped_qtr_nm',
+    'YoY - Monthly': 'prom_mth_num',
+    'YoY - Weekly': 'prom_year_wk_num',
+    'Quarterly': 'lped_qtr_yr_dt',
+    'Monthly': 'prom_mth_yr_dt',
+    'Weekly': 'prom_wk_end_dt',
+}
+
+# Period column -> the year column it is paired with
+PERIOD_TO_YEAR_COLNAME_DICT = {
+    'lped_qtr_nm': 'lped_year_num',
+    'prom_mth_num': 'prom_year_num',
+    'prom_year_wk_num': 'prom_year_num',
+    'lped_qtr_yr_dt': 'lped_year_num',
+    'prom_mth_yr_dt': 'prom_year_num',
+    'prom_wk_end_dt': 'prom_year_num',
+}
+
+
+def add_calendar_columns(df):
+    if 'prom_wk_end_dt' in df.columns and not pd.api.types.is_datetime64_any_dtype(df['prom_wk_end_dt']):
+        df['prom_wk_end_dt'] = pd.to_datetime(df['prom_wk_end_dt'])
+
+    # sales_profile only carries the month name
+    if 'prom_mth_num' not in df.columns and 'prom_month_nm' in df.columns:
+        df['prom_mth_num'] = df['prom_month_nm'].map(MONTH_NAME_TO_NUM).astype('int64')
+
+    if 'prom_mth_yr_dt' not in df.columns and {'prom_mth_num', 'prom_year_num'}.issubset(df.columns):
+        df['prom_mth_yr_dt'] = pd.to_datetime(
+            pd.DataFrame({'year': df['prom_year_num'], 'month': df['prom_mth_num'], 'day': 1})
+        )
+
+    if 'lped_qtr_yr_dt' not in df.columns and {'lped_qtr_nm', 'lped_year_num'}.issubset(df.columns):
+        df['lped_qtr_yr_dt'] = df['lped_qtr_nm'].str[:2] + '-' + df['lped_year_num'].astype(str)
+
+    return df
+
+
+def parse_year_col_name(st_ss_periodicity):
+    if 'Quarterly' in st_ss_periodicity:
+        return 'lped_year_num'
+    else:
+        return 'prom_year_num'
+
+
+def period_codes(df, periodicity):
+    """
+    One int32 per (period, year) pair of df's rows - the week end day number, or a month or LPED
+    quarter ordinal - that sorts in the same order as [year, period]. The chart groupbys key on
+    these rather than on datetimes, string quarter labels or (period, year) column pairs.
+    """
+    period = df[periodicity]
+    if periodicity == 'prom_wk_end_dt':
+        # Days since 1970-01-01, so week_end_dates() maps them straight back
+        return period.to_numpy().astype('datetime64[D]').astype('int32')
+    if periodicity == 'prom_mth_yr_dt':
+        return period.to_numpy().astype('datetime64[M]').astype('int32')
+
+    years = df[PERIOD_TO_YEAR_COLNAME_DICT[periodicity]].to_numpy().astype('int32')
+    if periodicity in ['lped_qtr_nm', 'lped_qtr_yr_dt']:
+        # 'Q1 (wk 9-21)' / 'Q1-2023' - the quarter number is parsed once per label, not per row
+        quarters = period.astype('category').cat
+        quarter_nums = quarters.categories.str[1].astype('int32').to_numpy()[quarters.codes]
+        return years * 4 + quarter_nums - 1
+    if periodicity == 'prom_mth_num':
+        return years * 12 + period.to_numpy().astype('int32') - 1
+    # prom_year_wk_num runs 1-53
+    return years * 53 + period.to_numpy().astype('int32') - 1
+
+
+def week_end_dates(week_codes):
+    # Inverse of period_codes() for prom_wk_end_dt
+    return pd.to_datetime(np.asarray(week_codes, dtype='int64'), unit='D')
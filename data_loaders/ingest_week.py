@@ -0,0 +1,68 @@
+"""
+Appends one new prom week to the weekly datasets without rebuilding them. Run from the repo root
+once that week's extracts land (named like the files in data/, holding only the new week):
+
+    python -m data_loaders.ingest_week --week 2023-08-06 --source-dir extracts/
+    python -m data_loaders.ingest_week --week 2023-08-06 --source-dir extracts/ --datasets baskets
+
+Each extract is prepared the same way as the build step and written as its own partition under
+data/increments/. The running app picks the new partition up on the next rerun: cached store
+blocks, rollups and benchmark aggregates for the existing weeks are kept, and only the new week
+is read. data_loaders.build_datasets folds the increments back into the main files.
+"""
+import argparse
+import os
+import pandas as pd
+import pyarrow.parquet as pq
+from data_loaders.build_datasets import STORES_PER_ROW_GROUP, prepare_table, write_store_row_groups
+from data_loaders.registry import DATA_DIR, DATASET_FILES, dataset_path, increment_file_nm, increments_path, list_increment_paths
+
+
+def latest_week(dataset, data_dir=DATA_DIR):
+    # Increments are named by week, so only the main file needs its dates read
+    increment_paths = list_increment_paths(dataset, data_dir)
+    if len(increment_paths) > 0:
+        return pd.Timestamp(os.path.splitext(os.path.basename(increment_paths[-1]))[0].split('=')[1])
+    source = dataset_path(dataset, data_dir)
+    if not os.path.exists(source):
+        return None
+    return pd.to_datetime(pq.read_table(source, columns=['prom_wk_end_dt']).to_pandas()['prom_wk_end_dt']).max()
+
+
+def ingest_week(dataset, week, source_dir, data_dir=DATA_DIR, stores_per_row_group=STORES_PER_ROW_GROUP):
+    week = pd.Timestamp(week)
+    source = os.path.join(source_dir, DATASET_FILES[dataset])
+    if not os.path.exists(source):
+        print(f"Skipping {dataset} - {source} not found")
+        return None
+
+    table = prepare_table(pq.read_table(source).to_pandas())
+    weeks_in_extract = pd.to_datetime(table['prom_wk_end_dt'].unique().to_pandas())
+    if len(weeks_in_extract) != 1 or weeks_in_extract[0] != week:
+        raise ValueError(f"{source} should only hold week {week.date()}, found {sorted(str(w.date()) for w in weeks_in_extract)}")
+    last_week = latest_week(dataset, data_dir)
+    if last_week is not None and week <= last_week:
+        raise ValueError(f"{dataset} already has data up to {last_week.date()} - weeks can only be appended")
+
+    os.makedirs(increments_path(dataset, data_dir), exist_ok=True)
+    target = os.path.join(increments_path(dataset, data_dir), increment_file_nm(week))
+    write_store_row_groups(table, target, stores_per_row_group)
+    print(f"Appended {target} - {table.num_rows} rows")
+    return target
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Append one prom week to the weekly parquet datasets.")
+    parser.add_argument('--week', required=True, help="prom_wk_end_dt of the new week, YYYY-MM-DD")
+    parser.add_argument('--source-dir', required=True, help="Directory holding the new week's extracts")
+    parser.add_argument('--datasets', nargs='+', choices=list(DATASET_FILES), default=list(DATASET_FILES))
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--stores-per-row-group', type=int, default=STORES_PER_ROW_GROUP)
+    args = parser.parse_args()
+
+    for dataset in args.datasets:
+        ingest_week(dataset, args.week, args.source_dir, args.data_dir, args.stores_per_row_group)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+import os
+import streamlit as st
+from data_loaders.calendar_columns import SELECTBOX_TO_COLNAME_DICT
+from data_loaders.registry import list_partitions
+from sql_queries.duckdb_queries import sales_chart_sums_query
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+
+# 'pandas' (default) aggregates the loaded frames, 'duckdb' compiles the tab settings into one SQL
+# aggregation run straight against the parquet files on every core. Set with QUERY_BACKEND=duckdb.
+QUERY_BACKEND = os.environ.get('QUERY_BACKEND', 'pandas')
+
+
+def use_duckdb():
+    return QUERY_BACKEND == 'duckdb' and duckdb is not None
+
+
+@st.cache_resource(show_spinner=False)
+def get_duckdb_connection():
+    # One in-memory database per server process - every query gets its own cursor, so sessions can run in parallel
+    return duckdb.connect()
+
+
+def make_sales_chart_sums(dataset, address_ids, departments, measures, st_ss_periodicity, promotion_ind=None, warehouse=None):
+    """
+    Per period sums for SalesChartDataframeCreator.make_sales_chart_input_df_from_sums(), plus the
+    number of stores that have rows after filtering.
+    """
+    query, params = sales_chart_sums_query(
+        [path for path, _ in list_partitions(dataset)],
+        sorted({int(address_id) for address_id in address_ids}),
+        list(departments),
+        list(measures),
+        SELECTBOX_TO_COLNAME_DICT[st_ss_periodicity],
+        promotion_ind=promotion_ind,
+        warehouse=warehouse,
+    )
+    with get_duckdb_connection().cursor() as cursor:
+        df_sums = cursor.execute(query, params).df()
+    store_count = int(df_sums['store_count'].iloc[0]) if len(df_sums) > 0 else 0
+    return df_sums.drop(columns='store_count'), store_count
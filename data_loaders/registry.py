@@ -0,0 +1,308 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import streamlit as st
+from data_loaders.calendar_columns import CALENDAR_COLUMNS, PERIOD_TO_YEAR_COLNAME_DICT, add_calendar_columns
+
+
+DATA_DIR = "data"
+# Weeks appended by data_loaders.ingest_week land in data/increments/<file stem>/prom_wk_end_dt=YYYY-MM-DD.parquet
+INCREMENTS_DIR = "increments"
+
+DATASET_FILES = {
+    'sales_gp_units': 'sales_gp_units_weekly.parquet',
+    'baskets': 'baskets_weekly.parquet',
+    'sales_profile': 'sales_profile_weekly.parquet',
+    'store_attributes': 'store_attributes_weekly.parquet',
+}
+
+
+# Low cardinality text columns, loaded as categoricals so filters and groupbys run on the codes
+DIMENSION_COLUMNS = [
+    'finance_department_nm', 'promotion_ind', 'warehouse', 'media_plc',
+    'recent_store_nm', 'administration_state_cd', 'prom_month_nm', 'lped_qtr_nm', 'lped_qtr_yr_dt',
+    'State', 'CHAN+ZFP', 'Subsidy Program 1', 'Subsidy Program 2', 'Promo Channel', 'ZFP',
+]
+
+
+def dataset_path(dataset, data_dir=None):
+    return os.path.join(data_dir or DATA_DIR, DATASET_FILES[dataset])
+
+
+def increments_path(dataset, data_dir=None):
+    return os.path.join(data_dir or DATA_DIR, INCREMENTS_DIR, os.path.splitext(DATASET_FILES[dataset])[0])
+
+
+def increment_file_nm(week):
+    return f"prom_wk_end_dt={pd.Timestamp(week).date().isoformat()}.parquet"
+
+
+def list_increment_paths(dataset, data_dir=None):
+    increments_dir = increments_path(dataset, data_dir)
+    if not os.path.isdir(increments_dir):
+        return []
+    # ISO dates in the file names, so name order is week order
+    return [
+        os.path.join(increments_dir, file_nm)
+        for file_nm in sorted(os.listdir(increments_dir)) if file_nm.endswith('.parquet')
+    ]
+
+
+def list_partitions(dataset):
+    """
+    The base file plus every appended week, as (path, mtime) pairs. Everything cached below is keyed
+    on a partition rather than the dataset, so appending a week only loads the new partition while
+    the existing ones stay cached - and a partition that is rewritten gets a new key.
+    """
+    paths = [dataset_path(dataset)] + list_increment_paths(dataset)
+    return tuple((path, os.stat(path).st_mtime_ns) for path in paths)
+
+
+@st.cache_resource(show_spinner=False, max_entries=128)
+def get_table(partition):
+    """
+    Each parquet file is opened ONCE per server process (memory mapped) and the Arrow table is
+    shared by every session. Treat it as read only - tabs get their own filtered frames through
+    load_stores_data() instead of each session caching a private pickled copy of the file.
+    """
+    path, _ = partition
+    table = pq.read_table(path, memory_map=True)
+    # Drop the pandas index that was written with the files, it carries no information
+    return table.select([col for col in table.column_names if not col.startswith('__index_level_')])
+
+
+@st.cache_resource(show_spinner=False, max_entries=128)
+def get_parquet_file(partition):
+    path, _ = partition
+    return pq.ParquetFile(path, memory_map=True)
+
+
+@st.cache_resource(show_spinner=False, max_entries=128)
+def get_row_group_index(partition):
+    """
+    address_id min/max of every row group, taken from the parquet footer statistics. Returns None
+    unless the file has been through data_loaders.build_datasets (i.e. row groups are sorted and
+    don't overlap), in which case reads fall back to the whole table.
+    """
+    metadata = get_parquet_file(partition).metadata
+    address_col_idx = metadata.schema.to_arrow_schema().get_field_index('address_id')
+    mins, maxs = [], []
+    for i in range(metadata.num_row_groups):
+        stats = metadata.row_group(i).column(address_col_idx).statistics
+        if stats is None or not stats.has_min_max:
+            return None
+        mins.append(stats.min)
+        maxs.append(stats.max)
+    mins, maxs = np.array(mins), np.array(maxs)
+    if metadata.num_row_groups < 2 or np.any(mins[1:] <= maxs[:-1]):
+        return None
+    return mins, maxs
+
+
+@st.cache_resource(show_spinner=False, max_entries=4096)
+def get_row_group(partition, row_group):
+    table = get_parquet_file(partition).read_row_group(row_group)
+    return table.select([col for col in table.column_names if not col.startswith('__index_level_')])
+
+
+def get_stores_table(partition, address_ids):
+    """Only decodes the row groups that can contain the requested stores when the file is address sorted."""
+    row_group_index = get_row_group_index(partition)
+    if row_group_index is None:
+        return get_table(partition)
+    mins, maxs = row_group_index
+    address_ids = np.sort(np.asarray(address_ids))
+    hits = np.searchsorted(address_ids, mins, side='left') < np.searchsorted(address_ids, maxs, side='right')
+    row_groups = [get_row_group(partition, i) for i in np.flatnonzero(hits).tolist()]
+    if len(row_groups) == 0:
+        return get_row_group(partition, 0).slice(0, 0)
+    return pa.concat_tables(row_groups)
+
+
+@st.cache_resource(show_spinner=False, max_entries=128)
+def get_partition_dimension_values(partition):
+    # Distinct values of every dimension column in one partition
+    path, _ = partition
+    file_columns = get_parquet_file(partition).schema_arrow.names
+    source_columns = [col for col in DIMENSION_COLUMNS + ['lped_year_num'] if col in file_columns]
+    df = pq.read_table(path, columns=source_columns).to_pandas().drop_duplicates()
+    df = add_calendar_columns(df)
+    return {col: set(df[col].dropna().unique()) for col in DIMENSION_COLUMNS if col in df.columns}
+
+
+@st.cache_resource(show_spinner=False, max_entries=32)
+def get_partitions_dimension_dtypes(partitions):
+    dimension_values = {}
+    for partition in partitions:
+        for col, values in get_partition_dimension_values(partition).items():
+            dimension_values.setdefault(col, set()).update(values)
+    return {col: pd.CategoricalDtype(sorted(values)) for col, values in dimension_values.items()}
+
+
+def get_dimension_dtypes(dataset):
+    """
+    Dataset-wide categories for every dimension column, so the per-store blocks all share one
+    CategoricalDtype and stay categorical when they are concatenated. Only a newly appended
+    partition is scanned for new values.
+    """
+    return get_partitions_dimension_dtypes(list_partitions(dataset))
+
+
+# Columns that place a week in every calendar the charts use
+CALENDAR_SOURCE_COLUMNS = [
+    'prom_wk_end_dt', 'prom_year_wk_num', 'prom_mth_num', 'prom_month_nm', 'prom_year_num', 'lped_qtr_nm', 'lped_year_num',
+]
+
+
+@st.cache_resource(show_spinner=False, max_entries=128)
+def get_partition_calendar(partition):
+    # One row per week in the partition, read from the calendar columns only
+    path, _ = partition
+    file_columns = get_parquet_file(partition).schema_arrow.names
+    source_columns = [col for col in dict.fromkeys(CALENDAR_SOURCE_COLUMNS + CALENDAR_COLUMNS) if col in file_columns]
+    df = pq.read_table(path, columns=source_columns).to_pandas().drop_duplicates(ignore_index=True)
+    return add_calendar_columns(df)
+
+
+@st.cache_resource(show_spinner=False, max_entries=32)
+def get_partitions_calendar_dimension(partitions):
+    df_calendar = pd.concat([get_partition_calendar(partition) for partition in partitions], ignore_index=True)
+    df_calendar = encode_dimensions(df_calendar, get_partitions_dimension_dtypes(partitions))
+    return {
+        periodicity: df_calendar[[periodicity, year_col_name]].drop_duplicates(ignore_index=True)
+        for periodicity, year_col_name in PERIOD_TO_YEAR_COLNAME_DICT.items()
+        if periodicity in df_calendar.columns
+    }
+
+
+def get_calendar_dimension(dataset):
+    """
+    periodicity column -> distinct (period, year) rows of the dataset, for ChartCalendarDates.
+    Worked out once per dataset version and shared by every session - read only.
+    """
+    return get_partitions_calendar_dimension(list_partitions(dataset))
+
+
+def encode_dimensions(df, dimension_dtypes=None):
+    if dimension_dtypes is None:
+        return df.astype({col: 'category' for col in DIMENSION_COLUMNS if col in df.columns})
+    # Only recast columns that don't already have the dtype, e.g. blocks loaded before an appended
+    # week brought in a new category
+    mismatched_dtypes = {
+        col: dtype for col, dtype in dimension_dtypes.items() if col in df.columns and df[col].dtype != dtype
+    }
+    return df.astype(mismatched_dtypes) if len(mismatched_dtypes) > 0 else df
+
+
+def read_stores(partition, address_ids, columns=None, dimension_dtypes=None):
+    table = get_stores_table(partition, address_ids)
+    if columns is not None:
+        # Keep any calendar columns the build step has already materialised
+        table = table.select(list(columns) + [col for col in CALENDAR_COLUMNS if col in table.column_names and col not in columns])
+    value_set = pa.array(address_ids, type=table.schema.field('address_id').type)
+    df = table.filter(pc.is_in(table['address_id'], value_set=value_set)).to_pandas()
+    return encode_dimensions(add_calendar_columns(df), dimension_dtypes)
+
+
+_store_blocks_lock = threading.Lock()
+
+
+@st.cache_resource(show_spinner=False, max_entries=1024)
+def get_store_blocks(partition, columns=None, block_kind=None):
+    """
+    address_id -> dataframe of that store's rows in one partition, shared across sessions and
+    filled in as stores are requested. At most one block per store in the partition, so it can't
+    outgrow the file. block_kind separates blocks derived from the rows, e.g. rollups.
+    """
+    return {}
+
+
+def collect_store_blocks(store_blocks, address_ids, read_missing_stores, dimension_dtypes=None):
+    """
+    Returns the cached per-store blocks for address_ids, calling read_missing_stores(missing_ids)
+    only for the stores that haven't been loaded yet. Blocks cached before an appended week brought
+    in a new category are recast to dimension_dtypes and written back, so each is recast once.
+    """
+    missing_ids = [address_id for address_id in address_ids if address_id not in store_blocks]
+    if len(missing_ids) > 0:
+        df = read_missing_stores(missing_ids)
+        new_blocks = dict(tuple(df.groupby('address_id', sort=False)))
+        with _store_blocks_lock:
+            for address_id in missing_ids:
+                # Stores with no rows are cached as empty blocks so they aren't looked up again
+                store_blocks[address_id] = new_blocks.get(address_id, df.iloc[0:0])
+
+    blocks = [store_blocks[address_id] for address_id in address_ids]
+    if dimension_dtypes is not None:
+        recast_blocks = {
+            address_id: encode_dimensions(block, dimension_dtypes) for address_id, block in zip(address_ids, blocks)
+        }
+        stale_blocks = {
+            address_id: block for address_id, block in recast_blocks.items() if block is not store_blocks[address_id]
+        }
+        if len(stale_blocks) > 0:
+            with _store_blocks_lock:
+                store_blocks.update(stale_blocks)
+            blocks = [recast_blocks[address_id] for address_id in address_ids]
+    return blocks
+
+
+def load_store_blocks(dataset, address_ids, columns=None, block_kind=None, transform=None):
+    """
+    Assembles the requested stores from the cached blocks of every partition of the dataset.
+    transform(df), if given, is applied to freshly read rows before they are cached as blocks.
+    """
+    address_ids = sorted(set(address_ids))
+    columns = tuple(columns) if columns is not None else None
+    dimension_dtypes = get_dimension_dtypes(dataset)
+
+    def read_missing_stores(partition, missing_ids):
+        df = read_stores(partition, missing_ids, columns, dimension_dtypes)
+        return df if transform is None else transform(df)
+
+    blocks = []
+    for partition in list_partitions(dataset):
+        blocks += collect_store_blocks(
+            get_store_blocks(partition, columns, block_kind),
+            address_ids,
+            lambda missing_ids: read_missing_stores(partition, missing_ids),
+            dimension_dtypes
+        )
+    # Weeks are only ever appended, so partition order keeps every store's rows in date order
+    df = pd.concat(blocks, ignore_index=True)
+    if len(blocks) > len(address_ids):
+        df = df.sort_values('address_id', kind='stable', ignore_index=True)
+    return encode_dimensions(df, dimension_dtypes)
+
+
+def load_stores_data(dataset, address_ids, columns=None):
+    """
+    Assembles the requested stores from cached per-store blocks. Adding a store to the benchmark
+    only reads that one store, rather than the whole list being re-read under a new cache key.
+    """
+    return load_store_blocks(dataset, address_ids, columns)
+
+
+def load_store_attributes():
+    # Shared across sessions - do not modify the returned dataframe in place
+    return load_partitions_store_attributes(list_partitions('store_attributes'))
+
+
+@st.cache_resource(show_spinner=False, max_entries=128)
+def get_partition_store_attributes(partition):
+    # Latest attributes of each store within one partition
+    df_store_attrs = add_calendar_columns(get_table(partition).to_pandas())
+    df_store_attrs = df_store_attrs.sort_values('prom_wk_end_dt', ascending=False)
+    return df_store_attrs.drop_duplicates('address_id', keep='first')
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def load_partitions_store_attributes(partitions):
+    # Newest partition first, so an appended week only has to be deduplicated against the current snapshot
+    df_store_attrs = pd.concat([get_partition_store_attributes(partition) for partition in reversed(partitions)])
+    df_store_attrs = df_store_attrs.drop_duplicates('address_id', keep='first')
+    return encode_dimensions(df_store_attrs)
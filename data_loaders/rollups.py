@@ -0,0 +1,40 @@
+from data_loaders.calendar_columns import SELECTBOX_TO_COLNAME_DICT, parse_year_col_name
+from data_loaders.registry import load_store_blocks, load_stores_data
+
+
+ROLLUP_DIMENSIONS = ['address_id', 'promotion_ind', 'warehouse', 'finance_department_nm']
+ROLLUP_MEASURES = ['sales_ex_gst', 'gp_ex_gst', 'sales_qty']
+# The raw rows are already one per store, week and rollup dimension, so a weekly rollup would be a
+# copy of them - these periodicities read the raw store blocks instead
+RAW_GRAIN_PERIODICITIES = ['YoY - Weekly', 'Weekly']
+# One column set for both weekly periodicities, so they share the same raw store blocks
+RAW_GRAIN_COLUMNS = ROLLUP_DIMENSIONS + ROLLUP_MEASURES + ['prom_wk_end_dt', 'prom_year_wk_num', 'prom_year_num']
+
+
+def build_rollup(df, st_ss_periodicity):
+    """
+    Sums the measures per store, period and the dimensions the Sales/GP/Units filters slice on.
+    Every chart aggregation on that tab is a sum over these rows, so it can read the rollup in
+    place of the raw weekly department rows (a quarter is ~13 weeks of rows collapsed into one).
+    """
+    periodicity = SELECTBOX_TO_COLNAME_DICT[st_ss_periodicity]
+    year_col_name = parse_year_col_name(st_ss_periodicity)
+    return df.groupby(
+        ROLLUP_DIMENSIONS + [periodicity, year_col_name], observed=True, sort=False
+    )[ROLLUP_MEASURES].sum().reset_index()
+
+
+def load_rollup_data(dataset, address_ids, st_ss_periodicity):
+    periodicity = SELECTBOX_TO_COLNAME_DICT[st_ss_periodicity]
+    year_col_name = parse_year_col_name(st_ss_periodicity)
+    if st_ss_periodicity in RAW_GRAIN_PERIODICITIES:
+        # Same columns, in the same order, as a rollup
+        df = load_stores_data(dataset, address_ids, RAW_GRAIN_COLUMNS)
+        return df[ROLLUP_DIMENSIONS + [periodicity, year_col_name] + ROLLUP_MEASURES]
+    # Rollups are cached per store and partition, so an appended week only rolls up the new rows
+    return load_store_blocks(
+        dataset,
+        address_ids,
+        block_kind=('rollup', st_ss_periodicity),
+        transform=lambda df: build_rollup(df, st_ss_periodicity)
+    )
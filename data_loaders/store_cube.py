@@ -0,0 +1,206 @@
+import threading
+import numpy as np
+import pandas as pd
+import streamlit as st
+from data_loaders.calendar_columns import add_calendar_columns, period_codes, week_end_dates
+from data_loaders.registry import encode_dimensions, get_partitions_dimension_dtypes, get_table, list_partitions
+
+
+# Dataset -> the measures its cube holds
+CUBE_MEASURES = {
+    'sales_gp_units': ['sales_ex_gst', 'gp_ex_gst', 'sales_qty'],
+}
+# The dimensions the Settings filters slice on, one side axis of the cube each
+CUBE_SIDE_DIMENSIONS = ['promotion_ind', 'warehouse', 'finance_department_nm']
+# Memory budget of one dataset's cube. It holds every store for the full history whichever stores
+# are selected - 8 bytes per measure plus a 4 byte row count per store x week x side value cell,
+# ~22 MB for 129 stores x 250 weeks x 2 x 2 x 6 side values - and grows with stores x weeks x
+# departments. Only the latest version of each dataset is kept (get_store_cubes()).
+STORE_CUBE_MAX_BYTES = 256 * 2**20
+
+
+class StoreWeekTotals:
+    """
+    A store group's measures summed per store and week: stores x weeks matrices (rows in
+    address_ids order, columns in week_codes order), NaN where a store has no rows in a week.
+    row_counts holds how many of the weekly department rows went into each cell.
+    """
+    def __init__(self, address_ids, week_codes, totals, row_counts, week_months):
+        self.address_ids = address_ids
+        self.week_codes = week_codes
+        self.totals = totals
+        self.row_counts = row_counts
+        self.week_months = week_months
+
+    def stores(self, address_ids):
+        rows = np.flatnonzero(np.isin(self.address_ids, list(address_ids)))
+        return StoreWeekTotals(
+            self.address_ids[rows], self.week_codes, {measure: totals[rows] for measure, totals in self.totals.items()},
+            self.row_counts[rows], self.week_months
+        )
+
+    def monthly_sums(self, measure):
+        # One row per store and month with any rows - address_id, prom_year_num, prom_month_nm and the measure
+        month_idx, months = pd.factorize(pd.MultiIndex.from_frame(self.week_months))
+        weeks_in_months = month_idx[:, None] == np.arange(len(months))
+        totals = np.nan_to_num(self.totals[measure]) @ weeks_in_months
+        store_rows, month_cols = np.nonzero((self.row_counts @ weeks_in_months) > 0)
+        return pd.DataFrame({
+            'address_id': self.address_ids[store_rows],
+            'prom_year_num': months.get_level_values(0)[month_cols],
+            'prom_month_nm': months.get_level_values(1)[month_cols],
+            measure: totals[store_rows, month_cols],
+        })
+
+
+class StoreWeekCube:
+    """
+    A dataset's measures as dense stores x weeks x promotion_ind x warehouse x finance_department_nm
+    arrays, summed from the weekly department rows once per dataset version and shared by every
+    session - read only. A store group under the Settings filters is then a gather of its rows and
+    the selected side values, summed over the side axes (store_week_totals()), rather than boolean
+    masks and groupbys over the long frame. Missing measure values count as zero. Raises
+    MemoryError, before allocating the arrays, when they would exceed STORE_CUBE_MAX_BYTES.
+    """
+    def __init__(self, df, measures):
+        self.address_ids, store_idx = np.unique(df['address_id'].to_numpy(), return_inverse=True)
+        self.week_codes, week_idx = np.unique(period_codes(df, 'prom_wk_end_dt'), return_inverse=True)
+        self.week_dates = week_end_dates(self.week_codes)
+        # Calendar month of each week, for monthly totals
+        self.week_months = pd.DataFrame({
+            'week_idx': week_idx,
+            'prom_year_num': df['prom_year_num'].to_numpy(),
+            'prom_month_nm': df['prom_month_nm'].astype(str).to_numpy(),
+        }).drop_duplicates('week_idx').sort_values('week_idx').drop(columns='week_idx').reset_index(drop=True)
+
+        self.side_values, side_idx = {}, []
+        for dim in CUBE_SIDE_DIMENSIONS:
+            values = df[dim].cat.categories.tolist()
+            codes = df[dim].cat.codes.to_numpy().astype('intp')
+            # Rows missing the dimension get a slot of their own, only selected when the dimension isn't filtered on
+            if (codes < 0).any():
+                values.append(None)
+                codes = np.where(codes < 0, len(values) - 1, codes)
+            self.side_values[dim] = values
+            side_idx.append(codes)
+
+        self.shape = (len(self.address_ids), len(self.week_codes)) + tuple(len(values) for values in self.side_values.values())
+        self.side_axes = tuple(range(2, len(self.shape)))
+        n_cells = int(np.prod(self.shape))
+        self.nbytes = n_cells * (8 * len(measures) + 4)
+        if self.nbytes > STORE_CUBE_MAX_BYTES:
+            raise MemoryError(
+                f"A {self.shape} store cube needs {self.nbytes / 2**20:.0f} MiB, over STORE_CUBE_MAX_BYTES "
+                f"({STORE_CUBE_MAX_BYTES / 2**20:.0f} MiB)"
+            )
+        cell_idx = np.ravel_multi_index((store_idx, week_idx, *side_idx), self.shape)
+        self.row_counts = np.bincount(cell_idx, minlength=n_cells).astype('int32').reshape(self.shape)
+        self.values = {
+            measure: np.bincount(
+                cell_idx, weights=np.nan_to_num(df[measure].to_numpy(dtype='float64')), minlength=n_cells
+            ).reshape(self.shape)
+            for measure in measures
+        }
+        # Whether each store has any rows in each week, whatever the filters
+        self.store_week_has_rows = self.row_counts.any(axis=self.side_axes)
+
+    def store_rows(self, address_ids):
+        return np.flatnonzero(np.isin(self.address_ids, list(address_ids)))
+
+    def week_columns(self, start_dt=None, end_dt=None):
+        in_range = np.ones(len(self.week_codes), dtype=bool)
+        if start_dt is not None:
+            in_range &= self.week_dates >= pd.Timestamp(start_dt)
+        if end_dt is not None:
+            in_range &= self.week_dates <= pd.Timestamp(end_dt)
+        return np.flatnonzero(in_range)
+
+    def side_index(self, dim, values=None):
+        # Positions of the selected values along a side axis - every slot when values is None
+        if values is None:
+            return np.arange(len(self.side_values[dim]))
+        values = set(values)
+        return np.array([i for i, value in enumerate(self.side_values[dim]) if value in values], dtype='intp')
+
+    def store_week_totals(self, address_ids, start_dt=None, end_dt=None, **side_filters):
+        """
+        The stores' measures per store and week between start_dt and end_dt (inclusive), over the
+        side dimension values in side_filters (dim=list of values, all of them when left out).
+        """
+        rows, weeks = self.store_rows(address_ids), self.week_columns(start_dt, end_dt)
+        cells = np.ix_(rows, weeks, *[self.side_index(dim, side_filters.get(dim)) for dim in CUBE_SIDE_DIMENSIONS])
+        row_counts = self.row_counts[cells].sum(axis=self.side_axes)
+        has_rows = row_counts > 0
+        totals = {
+            measure: np.where(has_rows, values[cells].sum(axis=self.side_axes), np.nan) for measure, values in self.values.items()
+        }
+        return StoreWeekTotals(
+            self.address_ids[rows], self.week_codes[weeks], totals, row_counts, self.week_months.iloc[weeks].reset_index(drop=True)
+        )
+
+    def active_store_counts(self, address_ids):
+        # Stores with any rows in each week, before the Settings filters - indexed by week code
+        store_counts = self.store_week_has_rows[self.store_rows(address_ids)].sum(axis=0)
+        has_stores = store_counts > 0
+        return pd.Series(store_counts[has_stores], index=self.week_codes[has_stores])
+
+    def side_values_with_rows(self, dim, address_ids, **side_filters):
+        # Values of one side dimension the stores have rows for under the other filters
+        cells = np.ix_(
+            self.store_rows(address_ids), np.arange(len(self.week_codes)),
+            *[self.side_index(side_dim, side_filters.get(side_dim)) for side_dim in CUBE_SIDE_DIMENSIONS]
+        )
+        dim_axis = 2 + CUBE_SIDE_DIMENSIONS.index(dim)
+        has_rows = self.row_counts[cells].any(axis=tuple(axis for axis in range(len(self.shape)) if axis != dim_axis))
+        selected_values = [self.side_values[dim][i] for i in self.side_index(dim, side_filters.get(dim))]
+        return [value for value, value_has_rows in zip(selected_values, has_rows) if value_has_rows and value is not None]
+
+    def week_range(self, address_ids):
+        # First and last week end dates the stores have rows for, None when they have none
+        weeks = np.flatnonzero(self.store_week_has_rows[self.store_rows(address_ids)].any(axis=0))
+        if weeks.size == 0:
+            return None
+        return self.week_dates[weeks[0]], self.week_dates[weeks[-1]]
+
+
+_store_cubes_lock = threading.Lock()
+
+
+@st.cache_resource(show_spinner=False)
+def get_store_cubes():
+    """
+    dataset -> (partitions, StoreWeekCube) of its latest version, shared across sessions. A new
+    partition list replaces the dataset's cube, so a superseded version isn't kept around after a
+    week is appended.
+    """
+    return {}
+
+
+def load_store_cube(dataset='sales_gp_units'):
+    partitions = list_partitions(dataset)
+    store_cubes = get_store_cubes()
+    with _store_cubes_lock:
+        cached = store_cubes.get(dataset)
+    if cached is not None and cached[0] == partitions:
+        return cached[1]
+    store_cube = build_store_cube(dataset, partitions)
+    with _store_cubes_lock:
+        store_cubes[dataset] = (partitions, store_cube)
+    return store_cube
+
+
+def build_store_cube(dataset, partitions):
+    """
+    Read straight from each partition's shared Arrow table, only the columns the cube needs, rather
+    than through load_stores_data() - that would cache a per-store block for every store on top of
+    the cube holding the same numbers. The cost is a cold start: the first Benchmark tab load after
+    the server starts, or after a week is appended, decodes those columns for the whole dataset.
+    """
+    measures = CUBE_MEASURES[dataset]
+    columns = ['address_id', 'prom_wk_end_dt', 'prom_year_num', 'prom_month_nm'] + CUBE_SIDE_DIMENSIONS + measures
+    dimension_dtypes = get_partitions_dimension_dtypes(partitions)
+    df = pd.concat([
+        encode_dimensions(add_calendar_columns(get_table(partition).select(columns).to_pandas()), dimension_dtypes)
+        for partition in partitions
+    ], ignore_index=True)
+    return StoreWeekCube(df, measures)
@@ -0,0 +1,38 @@
+import streamlit as st
+from data_loaders.registry import list_partitions, load_partitions_store_attributes
+
+
+class StoreAttributesIndex:
+    """
+    Current attributes of every store plus hash lookups on them, so picking a target store or a
+    benchmark group doesn't scan the attributes frame. Shared across sessions - read only.
+    """
+    def __init__(self, df_stores):
+        self.df_stores = df_stores
+        self.store_nms = df_stores['Store Name'].unique().tolist()
+        self.records = df_stores.to_dict(orient='records')
+        self.row_by_store_nm = {}
+        for row, store_nm in enumerate(df_stores['Store Name']):
+            # First row wins, same as taking [0] of a Store Name mask
+            self.row_by_store_nm.setdefault(store_nm, row)
+        self.row_by_address_id = {address_id: row for row, address_id in enumerate(df_stores['address_id'])}
+        self.rows_by_state_chanzfp = df_stores.groupby(['State', 'CHAN+ZFP'], observed=True, sort=False).indices
+
+    def store_record(self, store_nm):
+        return self.records[self.row_by_store_nm[store_nm]]
+
+    def stores_in_state_chanzfp(self, state, chanzfp):
+        return self.df_stores.iloc[self.rows_by_state_chanzfp.get((state, chanzfp), [])]
+
+    def attributes(self, address_ids, columns):
+        rows = [self.row_by_address_id[address_id] for address_id in address_ids if address_id in self.row_by_address_id]
+        return self.df_stores.iloc[rows][columns]
+
+
+def load_store_index():
+    return load_partitions_store_index(list_partitions('store_attributes'))
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def load_partitions_store_index(partitions):
+    return StoreAttributesIndex(load_partitions_store_attributes(partitions))
@@ -0,0 +1,69 @@
+from data_loaders.calendar_columns import PERIOD_TO_YEAR_COLNAME_DICT
+
+
+# Period keys worked out from the raw prom/lped columns, so the same query runs against files that
+# have been through data_loaders.build_datasets and ones that haven't (see calendar_columns.py)
+PERIOD_SQL_EXPRESSIONS = {
+    'lped_qtr_nm': "lped_qtr_nm",
+    'prom_mth_num': "prom_mth_num",
+    'prom_year_wk_num': "prom_year_wk_num",
+    'lped_qtr_yr_dt': "left(lped_qtr_nm, 2) || '-' || CAST(lped_year_num AS VARCHAR)",
+    'prom_mth_yr_dt': "CAST(make_date(prom_year_num, prom_mth_num, 1) AS TIMESTAMP)",
+    'prom_wk_end_dt': "CAST(prom_wk_end_dt AS TIMESTAMP)",
+}
+
+
+# Columns that can be summed - identifiers can't be bound as parameters, so only these are put into the SQL
+SUM_MEASURE_COLUMNS = ['sales_ex_gst', 'gp_ex_gst', 'sales_qty']
+
+
+def sales_chart_sums_query(parquet_paths, address_ids, departments, measures, periodicity,
+                           promotion_ind=None, warehouse=None):
+    """
+    Per period sums behind the Sales/GP/Units charts, for
+    SalesChartDataframeCreator.make_sales_chart_input_df_from_sums(). The indicator sums use
+    FILTER so a period without any 'Y' rows comes back NULL, as the pandas path leaves it NaN.
+    Returns the query and its named parameters for cursor.execute() - the filter values and file
+    paths are bound, and the measures and periodicity are checked against the known columns.
+    """
+    unknown_measures = [measure for measure in measures if measure not in SUM_MEASURE_COLUMNS]
+    if unknown_measures:
+        raise ValueError(f"Can't sum {unknown_measures} - expected columns from {SUM_MEASURE_COLUMNS}")
+    period_expression = PERIOD_SQL_EXPRESSIONS[periodicity]
+    year_col_name = PERIOD_TO_YEAR_COLNAME_DICT[periodicity]
+    total_columns = list(dict.fromkeys(list(measures) + ['gp_ex_gst', 'sales_ex_gst']))
+    source_columns = ['address_id', 'warehouse', 'promotion_ind'] + total_columns
+    sum_selects = [f'FSUM({measure}) AS "{measure}"' for measure in total_columns]
+    for measure in measures:
+        sum_selects.append(f"FSUM({measure}) FILTER (WHERE warehouse = 'Y') AS \"warehouse_{measure}\"")
+        sum_selects.append(f"FSUM({measure}) FILTER (WHERE promotion_ind = 'Y') AS \"promotion_ind_{measure}\"")
+    sum_selects = ",\n               ".join(sum_selects)
+    params = {'address_ids': list(address_ids), 'departments': list(departments)}
+    filters = ["address_id IN (SELECT unnest($address_ids))", "finance_department_nm IN (SELECT unnest($departments))"]
+    if promotion_ind is not None:
+        params['promotion_ind'] = promotion_ind
+        filters.append("promotion_ind = $promotion_ind")
+    if warehouse is not None:
+        params['warehouse'] = warehouse
+        filters.append("warehouse = $warehouse")
+    params.update({f'parquet_path_{i}': parquet_path for i, parquet_path in enumerate(parquet_paths)})
+    # One SELECT per partition - the main file and appended weeks can store the columns as different types
+    partition_selects = "\n            UNION ALL\n".join(
+        f"""
+            SELECT {period_expression} AS period, {year_col_name} AS year_num, {', '.join(source_columns)}
+            FROM read_parquet($parquet_path_{i})
+            WHERE {' AND '.join(filters)}"""
+        for i in range(len(parquet_paths))
+    )
+    query = f"""
+        WITH
+            filtered_table AS ({partition_selects}
+            )
+
+        SELECT period AS "{periodicity}", year_num AS "{year_col_name}",
+               {sum_selects},
+               (SELECT COUNT(DISTINCT address_id) FROM filtered_table) AS store_count
+        FROM filtered_table
+        GROUP BY period, year_num
+    """
+    return query, params
@@ -1,7 +1,9 @@
-import pandas as pd
 import streamlit as st
 from streamlit_option_menu import option_menu
 from charts.chart_tools import *
+from charts.figure_cache import build_concurrently, cached_chart_figures
+from data_loaders.benchmark_cache import benchmark_set_key, cached_benchmark_aggregate
+from data_loaders.registry import get_calendar_dimension, load_stores_data
 from datetime import datetime
 
 
@@ -29,25 +31,16 @@ def render_page():
     """
     Add target store address id with benchmark address ids to get the complete list of 
     address ids needed. Use set(list(x)) to remove duplicates in the event target store 
-    is included in the benchmark. This list is then used as a filter in the read_parquet 
-    function. Finally, Split into target and benchmark dataframes.
+    is included in the benchmark. This list is then passed to load_stores_data(), which 
+    returns those stores' rows from the cached per-store blocks. Finally, Split into 
+    target and benchmark dataframes.
     """
     address_list = list(set(st.session_state['benchmark_address_ids']))
     address_list.append(st.session_state['target_address_id'])
     address_list = list(set(address_list))
 
-    datasource = r"data/baskets_weekly.parquet"
-    
-    address_filter = [('address_id', 'in', address_list)]
-    
-    @st.cache_data
-    def load_baskets_data(data, address_filter):
-        return pd.read_parquet(data, filters=address_filter)
-
     # ---------------------------- Initialize Dataframes ---------------------------- #
-    data = load_baskets_data(datasource, address_filter)
-    data['prom_mth_yr_dt'] = pd.to_datetime(data['prom_mth_num'].astype(str) + data['prom_year_num'].astype(str), format='%m%Y')
-    data['lped_qtr_yr_dt'] = data['lped_qtr_nm'].str[:2] + '-' + data['lped_year_num'].astype(str)
+    data = load_stores_data('baskets', address_list)
     
     df_target_store = data[data['address_id'] == st.session_state['target_address_id']]
     df_benchmark_stores = data[data['address_id'].isin(st.session_state['benchmark_address_ids'])]
@@ -57,9 +50,9 @@ def render_page():
     
     # ------------------------------ Filters ------------------------------ #
     with st.expander(label="**Settings**", expanded=True):
-        # col1, col2 = st.columns(2)
+        col1, col2 = st.columns(2)
         
-        # with col1:
+        with col1:
         
             chart_mode_types = ["YoY - Quarterly", "YoY - Monthly", "YoY - Weekly", "Quarterly", "Monthly", "Weekly"]
 
@@ -76,6 +69,51 @@ def render_page():
                 key="new_periodicity",
                 on_change=chart_mode_idx_callback,
             )
+        with col2:
+            basket_average_types = ["Average of Store Averages", "Weighted by Baskets"]
+
+            if "basket_average_type" not in st.session_state:
+                st.session_state['basket_average_type'] = basket_average_types[0]
+
+            def basket_average_type_callback():
+                st.session_state['basket_average_type'] = st.session_state['new_basket_average_type']
+
+            st.selectbox(
+                label="**Basket Averages**",
+                help="_Weighted by Baskets = Total Items or Value / Total Baskets, so larger stores count for their share of baskets._",
+                options=basket_average_types,
+                index=basket_average_types.index(st.session_state['basket_average_type']),
+                key="new_basket_average_type",
+                on_change=basket_average_type_callback,
+            )
+
+            if "fast_render" not in st.session_state:
+                st.session_state['fast_render'] = False
+
+            def fast_render_callback():
+                st.session_state['fast_render'] = st.session_state['new_fast_render']
+
+            st.checkbox(
+                label="**Fast Chart Rendering**",
+                help=f"_Draws long weekly charts with WebGL from a shape preserving sample of {FAST_RENDER_MAX_POINTS} points. Lighter on slow laptops, but single weeks can drop out of the line charts - bars keep every week._",
+                value=st.session_state['fast_render'],
+                key="new_fast_render",
+                on_change=fast_render_callback,
+            )
+
+            if "combined_charts" not in st.session_state:
+                st.session_state['combined_charts'] = False
+
+            def combined_charts_callback():
+                st.session_state['combined_charts'] = st.session_state['new_combined_charts']
+
+            st.checkbox(
+                label="**Combine Charts**",
+                help="_Stacks each view's charts into one figure sharing the time axis, with the hover line running through every panel._",
+                value=st.session_state['combined_charts'],
+                key="new_combined_charts",
+                on_change=combined_charts_callback,
+            )
         # with col2:
         #     agg_mode_types = ["Average per Store", "Sum of Stores"]
 
@@ -118,11 +156,23 @@ def render_page():
     #     st.dataframe(df_benchmark_stores)
 
 
-    def spawn_charts(df, st_ss_periodicity=st.session_state['periodicity']):
-        bcdc = BasketsChartDataframeCreator(df_benchmark_stores)
-        df_input = bcdc.make_basket_chart_input_df(df, st_ss_periodicity)
-        
-        charts = ChartMaker()
+    benchmark_key = benchmark_set_key(st.session_state['benchmark_address_ids'])
+
+    # Builds the charts without drawing them, so the two store groups of the compare view can be built concurrently
+    def make_chart_figures(df, store_group, st_ss_periodicity=st.session_state['periodicity']):
+        weighted = st.session_state['basket_average_type'] == "Weighted by Baskets"
+
+        def make_df_input():
+            bcdc = BasketsChartDataframeCreator(get_calendar_dimension('baskets'))
+            return bcdc.make_basket_chart_input_df(df, st_ss_periodicity, weighted=weighted)
+
+        df_input = cached_benchmark_aggregate(
+            'basket_chart_input',
+            'baskets',
+            benchmark_key,
+            (store_group, st.session_state['target_address_id'], st_ss_periodicity, weighted),
+            make_df_input
+        )
 
         st_ss_periodicity = st.session_state['periodicity']
 
@@ -132,35 +182,42 @@ def render_page():
             'store_avg_basket_value': 'Avg Basket Value'
         }
 
-        def spawn_yoy_charts():
-            for metric, metric_renamed in metric_dict.items():
-                st.plotly_chart(
-                    charts.make_barchart_yoy(df_input, metric, metric_renamed, st_ss_periodicity).format_barchart_yoy(), 
-                    use_container_width=True
-                )
-
-        def spawn_timeseries_charts():
-            for metric, metric_renamed in metric_dict.items():
-                st.plotly_chart(
-                    charts.make_barchart_timeseries(df_input, metric, metric_renamed, st_ss_periodicity).format_barchart_timeseries(), 
-                    use_container_width=True
-                )
+        def yoy_chart_specs():
+            return [
+                ('barchart_yoy', (metric, metric_renamed, st_ss_periodicity), {})
+                for metric, metric_renamed in metric_dict.items()
+            ]
+
+        def timeseries_chart_specs():
+            return [
+                ('barchart_timeseries', (metric, metric_renamed, st_ss_periodicity), {'fast_render': st.session_state['fast_render']})
+                for metric, metric_renamed in metric_dict.items()
+            ]
             
         if 'YoY' in st_ss_periodicity:
-            spawn_yoy_charts()
+            chart_specs = yoy_chart_specs()
         else:
-            spawn_timeseries_charts()
+            chart_specs = timeseries_chart_specs()
+        return cached_chart_figures(df_input, chart_specs, combined=st.session_state['combined_charts'])
+
+    def spawn_charts(figs):
+        for fig in figs:
+            st.plotly_chart(fig, use_container_width=True)
 
     if view_option == "Target Store":
-        spawn_charts(df_target_store)
+        spawn_charts(make_chart_figures(df_target_store, "Target Store"))
     elif view_option == "Target Store vs Benchmark Group":
+        target_figs, benchmark_figs = build_concurrently(
+            lambda: make_chart_figures(df_target_store, "Target Store"),
+            lambda: make_chart_figures(df_benchmark_stores, "Benchmark Group")
+        )
         col1, col2 = st.columns(2)
         with col1:
-            spawn_charts(df_target_store)
+            spawn_charts(target_figs)
         with col2:
-            spawn_charts(df_benchmark_stores)
+            spawn_charts(benchmark_figs)
     elif view_option == "Benchmark Group":
-        spawn_charts(df_benchmark_stores)
+        spawn_charts(make_chart_figures(df_benchmark_stores, "Benchmark Group"))
 
     
     st.write(datetime.now() - t0)
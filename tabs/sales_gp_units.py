@@ -1,10 +1,24 @@
-import pandas as pd
 import streamlit as st
 from streamlit_option_menu import option_menu
 from charts.chart_tools import *
+from charts.figure_cache import build_concurrently, cached_chart_figures
+from data_loaders.benchmark_cache import benchmark_set_key, cached_benchmark_aggregate
+from data_loaders.query_backend import make_sales_chart_sums, use_duckdb
+from data_loaders.registry import get_calendar_dimension
+from data_loaders.rollups import load_rollup_data
 from datetime import datetime
 
 
+# Settings -> the column value each one keeps
+PROMOTION_IND_FILTERS = {"Non-Promo Only": "N", "Promo Only": "Y"}
+SALES_TYPE_WAREHOUSE_FILTERS = {"Warehouse": "Y", "Other Suppliers": "N"}
+CATEGORY_DEPARTMENTS = {
+    "Core Sales": ['GROCERY', 'DAIRY', 'FROZEN', 'VARIETY'],
+    "Fresh": ['BAKERY', 'DELI', 'FRUIT & VEG', 'MEAT', 'OTHER', 'SEAFOOD'],
+    "Tobacco & Liquor": ['TOBACCO', 'LIQUOR'],
+}
+
+
 # Read Parquet - Cached
 def render_page():
     t0 = datetime.now()
@@ -29,33 +43,34 @@ def render_page():
     """
     Add target store address id with benchmark address ids to get the complete list of 
     address ids needed. Use set(list(x)) to remove duplicates in the event target store 
-    is included in the benchmark. This list is then used as a filter in the read_parquet 
-    function. Finally, Split into target and benchmark dataframes.
+    is included in the benchmark. This list is then passed to load_rollup_data(), which 
+    returns those stores' rows rolled up to the selected periodicity from the cached per-store 
+    blocks. Finally, Split into target and benchmark dataframes.
     """
     address_list = list(set(st.session_state['benchmark_address_ids']))
     address_list.append(st.session_state['target_address_id'])
     address_list = list(set(address_list))
 
-    datasource = r"data/sales_gp_units_weekly.parquet"
-    
-    columns = ['address_id', 'finance_department_nm', 'promotion_ind',
-               'warehouse', 'sales_qty', 'sales_ex_gst', 'gp_ex_gst', 
-               'prom_wk_end_dt', 'prom_year_wk_num', 'prom_mth_num', 
-               'prom_month_nm', 'prom_year_num', 'lped_qtr_nm', 'lped_year_num']
-    
-    address_filter = [('address_id', 'in', address_list)]
-    
-    @st.cache_data
-    def load_sales_gp_units_data(data, columns, address_filter):
-        return pd.read_parquet(data, columns=columns, filters=address_filter)
+    # Periodicity is defaulted before the data load, because the rollup is built per periodicity
+    chart_mode_types = ["YoY - Quarterly", 
+                        "YoY - Monthly", 
+                        "YoY - Weekly", 
+                        "Quarterly", 
+                        "Monthly", 
+                        "Weekly"]
+
+    if "periodicity" not in st.session_state:
+        st.session_state['periodicity'] = chart_mode_types[-1]
 
     # ---------------------------- Initialize Dataframes ---------------------------- #
-    data = load_sales_gp_units_data(datasource, columns, address_filter)
-    data['prom_mth_yr_dt'] = pd.to_datetime(data['prom_mth_num'].astype(str) + data['prom_year_num'].astype(str), format='%m%Y')
-    data['lped_qtr_yr_dt'] = data['lped_qtr_nm'].str[:2] + '-' + data['lped_year_num'].astype(str)
+    # Pre-aggregated per store/period/promo/warehouse/department for the selected periodicity (the
+    # weekly periodicities are already at that grain, so they get the raw rows)
+    data = load_rollup_data('sales_gp_units', address_list, st.session_state['periodicity'])
     
     df_target_store = data[data['address_id'] == st.session_state['target_address_id']]
     df_benchmark_stores = data[data['address_id'].isin(st.session_state['benchmark_address_ids'])]
+    # Before the Settings filters - a store trading in a period counts as active whatever it sold
+    df_store_groups = {"Target Store": df_target_store, "Benchmark Group": df_benchmark_stores}
 
     # ------------------------------ Page Top ------------------------------ #
     st.header("**Sales/GP/Units** 📈")
@@ -64,16 +79,6 @@ def render_page():
     with st.expander(label="**Settings**", expanded=True):
         col1, col2, col3 = st.columns(3)
         with col1:
-            chart_mode_types = ["YoY - Quarterly", 
-                                "YoY - Monthly", 
-                                "YoY - Weekly", 
-                                "Quarterly", 
-                                "Monthly", 
-                                "Weekly"]
-
-            if "periodicity" not in st.session_state:
-                st.session_state['periodicity'] = chart_mode_types[-1]
-
             def chart_mode_idx_callback():
                 st.session_state['periodicity'] = st.session_state['new_periodicity']
 
@@ -103,7 +108,7 @@ def render_page():
                 on_change=promo_selection_idx_callback,
             )
         with col3:
-            agg_mode_types = ["Average per Store", "Sum of Stores"]
+            agg_mode_types = ["Average per Store", "Average per Active Store", "Sum of Stores"]
 
             if "agg_method" not in st.session_state:
                 st.session_state['agg_method'] = agg_mode_types[0]
@@ -113,19 +118,17 @@ def render_page():
 
             st.selectbox(
                 label="**Benchmark Aggregation Mode**",
-                help="_Choose to see Benchmark Group as Total or Average per Store._",
+                help="_Choose to see Benchmark Group as Total or Average per Store. Average per Active Store only counts the stores trading in each period._",
                 options=agg_mode_types,
                 index=agg_mode_types.index(st.session_state['agg_method']),
                 key="new_agg_method",
                 on_change=agg_method_idx_callback,
             )
         
-        if st.session_state['promotion_ind'] == "Non-Promo Only":
-            df_target_store = df_target_store[df_target_store['promotion_ind'] == "N"]
-            df_benchmark_stores = df_benchmark_stores[df_benchmark_stores['promotion_ind'] == "N"]
-        elif st.session_state['promotion_ind'] == "Promo Only":
-            df_target_store = df_target_store[df_target_store['promotion_ind'] == "Y"]
-            df_benchmark_stores = df_benchmark_stores[df_benchmark_stores['promotion_ind'] == "Y"]
+        promotion_ind = PROMOTION_IND_FILTERS.get(st.session_state['promotion_ind'])
+        if promotion_ind is not None:
+            df_target_store = df_target_store[df_target_store['promotion_ind'] == promotion_ind]
+            df_benchmark_stores = df_benchmark_stores[df_benchmark_stores['promotion_ind'] == promotion_ind]
 
         col1, col2, col3 = st.columns(3)
         with col1:
@@ -182,23 +185,15 @@ def render_page():
                 on_change=category_callback,
             )
 
-        if st.session_state['sales_type'] == "Warehouse":
-            df_target_store = df_target_store[df_target_store['warehouse'] == 'Y']
-            df_benchmark_stores = df_benchmark_stores[df_benchmark_stores['warehouse'] == 'Y']
-        elif st.session_state['sales_type'] == "Other Suppliers":
-            df_target_store = df_target_store[df_target_store['warehouse'] == 'N']
-            df_benchmark_stores = df_benchmark_stores[df_benchmark_stores['warehouse'] == 'N']
-
-        if st.session_state['category_type'] != "Custom":
-            if st.session_state['category_type'] == "Core Sales":
-                df_target_store = df_target_store[df_target_store['finance_department_nm'].isin(['GROCERY', 'DAIRY', 'FROZEN', 'VARIETY'])]
-                df_benchmark_stores = df_benchmark_stores[df_benchmark_stores['finance_department_nm'].isin(['GROCERY', 'DAIRY', 'FROZEN', 'VARIETY'])]
-            elif st.session_state['category_type'] == "Fresh":
-                df_target_store = df_target_store[df_target_store['finance_department_nm'].isin(['BAKERY', 'DELI', 'FRUIT & VEG', 'MEAT', 'OTHER', 'SEAFOOD'])]
-                df_benchmark_stores = df_benchmark_stores[df_benchmark_stores['finance_department_nm'].isin(['BAKERY', 'DELI', 'FRUIT & VEG', 'MEAT', 'OTHER', 'SEAFOOD'])]
-            elif st.session_state['category_type'] == "Tobacco & Liquor":
-                df_target_store = df_target_store[df_target_store['finance_department_nm'].isin(['TOBACCO', 'LIQUOR'])]
-                df_benchmark_stores = df_benchmark_stores[df_benchmark_stores['finance_department_nm'].isin(['TOBACCO', 'LIQUOR'])]
+        warehouse = SALES_TYPE_WAREHOUSE_FILTERS.get(st.session_state['sales_type'])
+        if warehouse is not None:
+            df_target_store = df_target_store[df_target_store['warehouse'] == warehouse]
+            df_benchmark_stores = df_benchmark_stores[df_benchmark_stores['warehouse'] == warehouse]
+
+        category_departments = CATEGORY_DEPARTMENTS.get(st.session_state['category_type'])
+        if category_departments is not None:
+            df_target_store = df_target_store[df_target_store['finance_department_nm'].isin(category_departments)]
+            df_benchmark_stores = df_benchmark_stores[df_benchmark_stores['finance_department_nm'].isin(category_departments)]
 
         dept_filter_options = df_benchmark_stores['finance_department_nm'].unique().tolist()
 
@@ -224,6 +219,34 @@ def render_page():
             on_change=callback_dept_filter
         )
 
+        if "fast_render" not in st.session_state:
+            st.session_state['fast_render'] = False
+
+        def fast_render_callback():
+            st.session_state['fast_render'] = st.session_state['new_fast_render']
+
+        st.checkbox(
+            label="**Fast Chart Rendering**",
+            help=f"_Draws long weekly charts with WebGL from a shape preserving sample of {FAST_RENDER_MAX_POINTS} points. Lighter on slow laptops, but single weeks can drop out of the line charts - bars keep every week._",
+            value=st.session_state['fast_render'],
+            key="new_fast_render",
+            on_change=fast_render_callback,
+        )
+
+        if "combined_charts" not in st.session_state:
+            st.session_state['combined_charts'] = False
+
+        def combined_charts_callback():
+            st.session_state['combined_charts'] = st.session_state['new_combined_charts']
+
+        st.checkbox(
+            label="**Combine Charts**",
+            help="_Stacks each view's charts into one figure sharing the time axis, with the hover line running through every panel._",
+            value=st.session_state['combined_charts'],
+            key="new_combined_charts",
+            on_change=combined_charts_callback,
+        )
+
         # if len(st.session_state['dept_filter']) > 0:
         df_target_store = df_target_store[df_target_store['finance_department_nm'].isin(st.session_state['dept_filter'])]
         df_benchmark_stores = df_benchmark_stores[df_benchmark_stores['finance_department_nm'].isin(st.session_state['dept_filter'])]
@@ -256,8 +279,12 @@ def render_page():
     # with st.expander(label="Unfiltered/Unsliced Dataframe", expanded=False):
     #     st.dataframe(data)
 
-    def spawn_charts(
+    benchmark_key = benchmark_set_key(st.session_state['benchmark_address_ids'])
+
+    # Builds the charts without drawing them, so the two store groups of the compare view can be built concurrently
+    def make_chart_figures(
         df,
+        store_group,
         measure = st.session_state['measure_type'],
         st_ss_periodicity = st.session_state['periodicity'],
         st_ss_agg_method = st.session_state['agg_method']
@@ -270,71 +297,100 @@ def render_page():
         metric = measure_dict[measure]
         metric_renamed = measure
 
-        scdc = SalesChartDataframeCreator(df_benchmark_stores)
-        df_input = scdc.make_sales_chart_input_df(df, metric, st_ss_periodicity, st_ss_agg_method)
+        def make_df_input():
+            scdc = SalesChartDataframeCreator(get_calendar_dimension('sales_gp_units'))
+            df_active_stores = None
+            if st_ss_agg_method == 'Average per Active Store':
+                df_active_stores = cached_benchmark_aggregate(
+                    'active_store_counts',
+                    'sales_gp_units',
+                    benchmark_key,
+                    (store_group, st.session_state['target_address_id'], st_ss_periodicity),
+                    lambda: scdc.make_active_store_count_df(df_store_groups[store_group], st_ss_periodicity)
+                )
+            if use_duckdb():
+                if store_group == "Target Store":
+                    address_ids = [st.session_state['target_address_id']]
+                else:
+                    address_ids = st.session_state['benchmark_address_ids']
+                departments = [
+                    dept for dept in st.session_state['dept_filter']
+                    if category_departments is None or dept in category_departments
+                ]
+                df_sums, store_count = make_sales_chart_sums(
+                    'sales_gp_units', address_ids, departments, SALES_MEASURES, st_ss_periodicity, promotion_ind, warehouse
+                )
+                return scdc.make_sales_chart_input_df_from_sums(
+                    df_sums, store_count, SALES_MEASURES, st_ss_periodicity, st_ss_agg_method, df_active_stores
+                )
+            return scdc.make_sales_chart_input_wide_df(df, st_ss_periodicity, st_ss_agg_method, df_active_stores=df_active_stores)
+
+        # Every measure at once, shared with every session looking at the same target store and
+        # benchmark group - switching Measure Type only picks different columns out of it
+        df_input_all_measures = cached_benchmark_aggregate(
+            'sales_chart_input',
+            'sales_gp_units',
+            benchmark_key,
+            (
+                store_group, st.session_state['target_address_id'], st_ss_periodicity, st_ss_agg_method,
+                st.session_state['promotion_ind'], st.session_state['sales_type'], 
+                st.session_state['category_type'], tuple(st.session_state['dept_filter'])
+            ),
+            make_df_input
+        )
+        df_input = SalesChartDataframeCreator.select_measure(df_input_all_measures, metric, st_ss_periodicity)
 
         if st_ss_periodicity == 'YoY - Quarterly':
             df_input = df_input.iloc[1:]
 
-        charts = ChartMaker()
+        fast_render = st.session_state['fast_render']
         
-        def spawn_yoy_charts():
-            st.plotly_chart(
-                charts.make_barchart_yoy(df_input, metric, metric_renamed, st_ss_periodicity).format_barchart_yoy(), 
-                use_container_width=True
-            )
+        chart_args = (metric, metric_renamed, st_ss_periodicity)
+
+        def yoy_chart_specs():
+            chart_specs = [('barchart_yoy', chart_args, {})]
             if measure == 'Gross Profit ex GST':
-                st.plotly_chart(
-                    charts.make_ratio_linechart_yoy(df_input, metric, metric_renamed, st_ss_periodicity).format_ratio_linechart_yoy(), 
-                    use_container_width=True
-                )
-            st.plotly_chart(
-                charts.make_ratio_linechart_yoy(df_input, metric, metric_renamed, st_ss_periodicity, 'warehouse').format_ratio_linechart_yoy(), 
-                use_container_width=True
-            )
-            st.plotly_chart(
-                charts.make_ratio_linechart_yoy(df_input, metric, metric_renamed, st_ss_periodicity, 'promotion_ind').format_ratio_linechart_yoy(), 
-                use_container_width=True
-            )
+                chart_specs.append(('ratio_linechart_yoy', chart_args, {}))
+            chart_specs.append(('ratio_linechart_yoy', chart_args + ('warehouse',), {}))
+            chart_specs.append(('ratio_linechart_yoy', chart_args + ('promotion_ind',), {}))
+            return chart_specs
 
-        def spawn_timeseries_charts():
-            st.plotly_chart(
-                charts.make_barchart_timeseries(df_input, metric, metric_renamed, st_ss_periodicity).format_barchart_timeseries(), 
-                use_container_width=True
-            )
+        def timeseries_chart_specs():
+            chart_specs = [('barchart_timeseries', chart_args, {'fast_render': fast_render})]
             if measure == 'Gross Profit ex GST':
-                st.plotly_chart(
-                    charts.make_linechart_timeseries(df_input, metric, metric_renamed, st_ss_periodicity, indicator='gp_pct').fig, 
-                    use_container_width=True
-                )
-            st.plotly_chart(
-                charts.make_linechart_timeseries(df_input, metric, metric_renamed, st_ss_periodicity, indicator='warehouse').fig, 
-                use_container_width=True
-            )
-            st.plotly_chart(
-                charts.make_linechart_timeseries(df_input, metric, metric_renamed, st_ss_periodicity, indicator='promotion_ind').fig, 
-                use_container_width=True
-            )
+                chart_specs.append(('linechart_timeseries', chart_args, {'indicator': 'gp_pct', 'fast_render': fast_render}))
+            chart_specs.append(('linechart_timeseries', chart_args, {'indicator': 'warehouse', 'fast_render': fast_render}))
+            chart_specs.append(('linechart_timeseries', chart_args, {'indicator': 'promotion_ind', 'fast_render': fast_render}))
+            return chart_specs
 
         if 'YoY' in st_ss_periodicity:
-            spawn_yoy_charts()
+            chart_specs = yoy_chart_specs()
         else:
-            spawn_timeseries_charts()
+            chart_specs = timeseries_chart_specs()
+        return cached_chart_figures(df_input, chart_specs, combined=st.session_state['combined_charts'])
         
         # with st.expander(label="View/Download Data", expanded=False):
         #     st.dataframe(df_input, use_container_width=True)
 
+    def spawn_charts(figs):
+        for fig in figs:
+            st.plotly_chart(fig, use_container_width=True)
+
     if len(st.session_state['dept_filter']) > 0:
         if view_option == "Target Store":
-            spawn_charts(df_target_store)
+            spawn_charts(make_chart_figures(df_target_store, "Target Store"))
         elif view_option == "Target Store vs Benchmark Group":
+            target_figs, benchmark_figs = build_concurrently(
+                lambda: make_chart_figures(df_target_store, "Target Store"),
+                lambda: make_chart_figures(df_benchmark_stores, "Benchmark Group")
+            )
             col1, col2 = st.columns(2)
             with col1:
-                spawn_charts(df_target_store)
+                spawn_charts(target_figs)
             with col2:
-                spawn_charts(df_benchmark_stores)
+                spawn_charts(benchmark_figs)
         elif view_option == "Benchmark Group":
-            spawn_charts(df_benchmark_stores)
+            spawn_charts(make_chart_figures(df_benchmark_stores, "Benchmark Group"))
 
 
     st.write(datetime.now() - t0)
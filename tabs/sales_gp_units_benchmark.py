@@ -1,10 +1,29 @@
-import pandas as pd
 import streamlit as st
-from charts.indexed_charts import create_df_indexed_metric, indexed_comps_chart
+from charts.chart_tools import SALES_MEASURES
+from charts.indexed_charts import indexed_comps_chart, make_df_indexed_metrics, select_indexed_metric
 from charts.bubble_charts import store_bubble_chart
+from charts.percentile_charts import make_df_percentile_ranks, percentile_rank_chart
+from charts.figure_cache import build_concurrently
+from data_loaders.benchmark_cache import benchmark_set_key, cached_benchmark_aggregate
+from data_loaders.store_cube import load_store_cube
+from data_loaders.store_index import load_store_index
 from datetime import datetime
 
 
+# Bubble Chart Months -> how many of the latest months the animation keeps
+BUBBLE_CHART_MONTHS = {"All Months": None, "Last 24 Months": 24, "Last 12 Months": 12}
+
+# Settings selectbox -> the promotion_ind / warehouse values it keeps (all of them when it isn't listed)
+PROMOTION_IND_FILTERS = {"Non-Promo Only": ["N"], "Promo Only": ["Y"]}
+SALES_TYPE_FILTERS = {"Warehouse": ["Y"], "Customer Directs": ["N"]}
+# Category -> its finance departments
+CATEGORY_DEPARTMENTS = {
+    "Core Sales": ['GROCERY', 'DAIRY', 'FROZEN', 'VARIETY'],
+    "Fresh": ['BAKERY', 'DELI', 'FRUIT & VEG', 'MEAT', 'OTHER', 'SEAFOOD'],
+    "Tobacco & Liquor": ['TOBACCO', 'LIQUOR'],
+}
+
+
 # Read Parquet - Cached
 def render_page():
     t0 = datetime.now()
@@ -29,50 +48,32 @@ def render_page():
     """
     Add target store address id with benchmark address ids to get the complete list of 
     address ids needed. Use set(list(x)) to remove duplicates in the event target store 
-    is included in the benchmark. This list is then used as a filter in the read_parquet 
-    function. Finally, Split into target and benchmark dataframes.
+    is included in the benchmark. The store x week cube of every store is shared across 
+    sessions, so the target store and benchmark group are gathered out of it below once 
+    the Settings filters are known.
     """
-    @st.cache_data(show_spinner=False)
-    def load_store_attributes():
-        df_store_attrs = pd.read_parquet(r'data/store_attributes_weekly.parquet')
-        df_store_attrs = df_store_attrs.sort_values('prom_wk_end_dt', ascending=False)
-        df_store_attrs = df_store_attrs.drop_duplicates('address_id', keep='first')
-        return df_store_attrs
-    
-    df_stores = load_store_attributes()
+    store_index = load_store_index()
+    try:
+        store_cube = load_store_cube('sales_gp_units')
+    except MemoryError as e:
+        st.error(f"The Benchmark data is too large to load: {e}")
+        return
 
     address_list = list(set(st.session_state['benchmark_address_ids']))
     address_list.append(st.session_state['target_address_id'])
     address_list = list(set(address_list))
 
-    datasource = r"data/sales_gp_units_weekly.parquet"
-    
-    columns = ['address_id', 'finance_department_nm', 'promotion_ind',
-               'warehouse', 'sales_qty', 'sales_ex_gst', 'gp_ex_gst', 
-               'prom_wk_end_dt', 'prom_year_wk_num', 'prom_mth_num', 
-               'prom_month_nm', 'prom_year_num', 'lped_qtr_nm', 'lped_year_num']
-    
-    address_filter = [('address_id', 'in', address_list)]
-    
-    @st.cache_data
-    def load_sales_gp_units_data(data, columns, address_filter):
-        return pd.read_parquet(data, columns=columns, filters=address_filter)
-
-    # ---------------------------- Initialize Dataframes ---------------------------- #
-    data = load_sales_gp_units_data(datasource, columns, address_filter)
-    data['prom_mth_yr_dt'] = pd.to_datetime(data['prom_mth_num'].astype(str) + data['prom_year_num'].astype(str), format='%m%Y')
-    data['lped_qtr_yr_dt'] = data['lped_qtr_nm'].str[:2] + '-' + data['lped_year_num'].astype(str)
-    data['prom_wk_end_dt'] = pd.to_datetime(data['prom_wk_end_dt']).dt.date
-    min_dt = min(data['prom_wk_end_dt'])
-    max_dt = max(data['prom_wk_end_dt'])
+    # ---------------------------- Initialize Date Range ---------------------------- #
+    week_range = store_cube.week_range(address_list)
+    if week_range is None:
+        st.warning("No Sales, GP & Units data for the target store or benchmark stores. Choose other stores in the **Store Selection** tab")
+        return
+    min_dt, max_dt = week_range[0].date(), week_range[1].date()
 
     if 'start_dt' not in st.session_state:
         st.session_state['start_dt'] = min_dt
     if 'end_dt' not in st.session_state:
         st.session_state['end_dt'] = max_dt
-    
-    df_target_store = data[data['address_id'] == st.session_state['target_address_id']]
-    df_benchmark_stores = data[data['address_id'].isin(st.session_state['benchmark_address_ids'])]
 
     # ------------------------------ Page Top ------------------------------ #
     st.header("**Benchmark - Sales, GP & Units** ⚖️")
@@ -106,7 +107,7 @@ def render_page():
                 on_change=promo_selection_idx_callback,
             )
         with col3:
-            agg_mode_types = ["Average per Store", "Sum of Stores"]
+            agg_mode_types = ["Average per Store", "Average per Active Store", "Sum of Stores"]
 
             if "agg_method" not in st.session_state:
                 st.session_state['agg_method'] = agg_mode_types[0]
@@ -116,19 +117,12 @@ def render_page():
 
             st.selectbox(
                 label="**Benchmark Aggregation Mode**",
-                help="_Average per Store = Unweighted Average, Sum of Stores = Weighted Average_",
+                help="_Average per Store = Unweighted Average, Average per Active Store = Total / Stores trading that week, Sum of Stores = Weighted Average_",
                 options=agg_mode_types,
                 index=agg_mode_types.index(st.session_state['agg_method']),
                 key="new_agg_method",
                 on_change=agg_method_idx_callback,
             )
-        
-        if st.session_state['promotion_ind'] == "Non-Promo Only":
-            df_target_store = df_target_store[df_target_store['promotion_ind'] == "N"]
-            df_benchmark_stores = df_benchmark_stores[df_benchmark_stores['promotion_ind'] == "N"]
-        elif st.session_state['promotion_ind'] == "Promo Only":
-            df_target_store = df_target_store[df_target_store['promotion_ind'] == "Y"]
-            df_benchmark_stores = df_benchmark_stores[df_benchmark_stores['promotion_ind'] == "Y"]
 
         col1, col2, col3 = st.columns(3)
         with col1:
@@ -185,26 +179,18 @@ def render_page():
                 on_change=category_callback,
             )
 
-        if st.session_state['sales_type'] == "Warehouse":
-            df_target_store = df_target_store[df_target_store['warehouse'] == 'Y']
-            df_benchmark_stores = df_benchmark_stores[df_benchmark_stores['warehouse'] == 'Y']
-        elif st.session_state['sales_type'] == "Customer Directs":
-            df_target_store = df_target_store[df_target_store['warehouse'] == 'N']
-            df_benchmark_stores = df_benchmark_stores[df_benchmark_stores['warehouse'] == 'N']
-
+        side_filters = {
+            'promotion_ind': PROMOTION_IND_FILTERS.get(st.session_state['promotion_ind']),
+            'warehouse': SALES_TYPE_FILTERS.get(st.session_state['sales_type']),
+        }
+        category_departments = None
         if st.session_state['category_type'] != "Custom":
-            if st.session_state['category_type'] == "Core Sales":
-                df_target_store = df_target_store[df_target_store['finance_department_nm'].isin(['GROCERY', 'DAIRY', 'FROZEN', 'VARIETY'])]
-                df_benchmark_stores = df_benchmark_stores[df_benchmark_stores['finance_department_nm'].isin(['GROCERY', 'DAIRY', 'FROZEN', 'VARIETY'])]
-            elif st.session_state['category_type'] == "Fresh":
-                df_target_store = df_target_store[df_target_store['finance_department_nm'].isin(['BAKERY', 'DELI', 'FRUIT & VEG', 'MEAT', 'OTHER', 'SEAFOOD'])]
-                df_benchmark_stores = df_benchmark_stores[df_benchmark_stores['finance_department_nm'].isin(['BAKERY', 'DELI', 'FRUIT & VEG', 'MEAT', 'OTHER', 'SEAFOOD'])]
-            elif st.session_state['category_type'] == "Tobacco & Liquor":
-                df_target_store = df_target_store[df_target_store['finance_department_nm'].isin(['TOBACCO', 'LIQUOR'])]
-                df_benchmark_stores = df_benchmark_stores[df_benchmark_stores['finance_department_nm'].isin(['TOBACCO', 'LIQUOR'])]
-
-       
-        dept_filter_options = df_benchmark_stores['finance_department_nm'].unique().tolist()
+            category_departments = CATEGORY_DEPARTMENTS.get(st.session_state['category_type'])
+
+        dept_filter_options = store_cube.side_values_with_rows(
+            'finance_department_nm', st.session_state['benchmark_address_ids'],
+            finance_department_nm=category_departments, **side_filters
+        )
 
         if 'dept_filter' not in st.session_state:
             st.session_state['dept_filter'] = dept_filter_options
@@ -215,18 +201,42 @@ def render_page():
 
         st.multiselect(
             label="**Department Filter**",
-            options=df_benchmark_stores['finance_department_nm'].unique().tolist(),
+            options=dept_filter_options,
             default=st.session_state['dept_filter'],
             key="new_dept_filter",
             on_change=callback_dept_filter
         )
 
+        if "bubble_chart_months" not in st.session_state:
+            st.session_state['bubble_chart_months'] = list(BUBBLE_CHART_MONTHS)[0]
+
+        def bubble_chart_months_callback():
+            st.session_state['bubble_chart_months'] = st.session_state['new_bubble_chart_months']
+
+        st.selectbox(
+            label="**Bubble Chart Months**",
+            help="_Animate the Sales per sqm chart over fewer months for a lighter, faster loading chart._",
+            options=list(BUBBLE_CHART_MONTHS),
+            index=list(BUBBLE_CHART_MONTHS).index(st.session_state['bubble_chart_months']),
+            key="new_bubble_chart_months",
+            on_change=bubble_chart_months_callback,
+        )
+
         # if len(st.session_state['dept_filter']) > 0:
-        df_target_store = df_target_store[df_target_store['finance_department_nm'].isin(st.session_state['dept_filter'])]
-        df_benchmark_stores = df_benchmark_stores[df_benchmark_stores['finance_department_nm'].isin(st.session_state['dept_filter'])]
+        side_filters['finance_department_nm'] = [
+            dept for dept in st.session_state['dept_filter'] if category_departments is None or dept in category_departments
+        ]
 
-        df_target_store = df_target_store[df_target_store['prom_wk_end_dt'].between(st.session_state['start_dt'], st.session_state['end_dt'])]
-        df_benchmark_stores = df_benchmark_stores[df_benchmark_stores['prom_wk_end_dt'].between(st.session_state['start_dt'], st.session_state['end_dt'])]
+        # Every store in the view per store and week under the filters - the target store and benchmark group are row gathers of it
+        store_week_totals = store_cube.store_week_totals(
+            address_list, st.session_state['start_dt'], st.session_state['end_dt'], **side_filters
+        )
+        target_totals = store_week_totals.stores([st.session_state['target_address_id']])
+        benchmark_totals = store_week_totals.stores(st.session_state['benchmark_address_ids'])
+        store_group_totals = {"Target Store": target_totals, "Benchmark Group": benchmark_totals}
+        store_group_address_ids = {
+            "Target Store": [st.session_state['target_address_id']], "Benchmark Group": st.session_state['benchmark_address_ids']
+        }
 
     # ------------------------ Benchmark Date Range ------------------------ #
     col1, col2 = st.columns(2)
@@ -256,8 +266,10 @@ def render_page():
         )
 
     # with st.expander(label="Filtered Input Dataframes", expanded=True):
-        # st.dataframe(df_target_store, use_container_width=True)
-        # st.dataframe(df_benchmark_stores, use_container_width=True)
+        # st.dataframe(target_totals.monthly_sums('sales_ex_gst'), use_container_width=True)
+        # st.dataframe(benchmark_totals.monthly_sums('sales_ex_gst'), use_container_width=True)
+
+    benchmark_key = benchmark_set_key(st.session_state['benchmark_address_ids'])
 
     def spawn_charts(measure=st.session_state['measure_type'], st_ss_agg_method=st.session_state['agg_method']):
         measure_dict = {
@@ -268,21 +280,63 @@ def render_page():
         metric = measure_dict[measure]
         metric_renamed = measure
 
-        df_store_sales_idx = create_df_indexed_metric(df_target_store, metric, metric_renamed, st_ss_agg_method)
-        df_benchmark_sales_idx = create_df_indexed_metric(df_benchmark_stores, metric, metric_renamed, st_ss_agg_method)
+        def make_df_indexed(store_group):
+            active_store_counts = None
+            if st_ss_agg_method == 'Average per Active Store':
+                # Before the Settings filters - a store trading in a week counts as active whatever it sold
+                active_store_counts = store_cube.active_store_counts(store_group_address_ids[store_group])
+            # Plain and cumulative sum versions of every measure, both indexed on the first wk_start_dt
+            return make_df_indexed_metrics(
+                store_group_totals[store_group], SALES_MEASURES, st_ss_agg_method, active_store_counts=active_store_counts
+            )
+
+        # Without the measure - switching Measure Type only picks different columns out of the indexed metrics
+        filter_params = (
+            st.session_state['target_address_id'], st_ss_agg_method, st.session_state['promotion_ind'], 
+            st.session_state['sales_type'], st.session_state['category_type'], tuple(st.session_state['dept_filter']),
+            st.session_state['start_dt'], st.session_state['end_dt']
+        )
+        df_store_indexed, df_benchmark_indexed = build_concurrently(
+            lambda: cached_benchmark_aggregate(
+                'indexed_metrics', 'sales_gp_units', benchmark_key, ("Target Store",) + filter_params, lambda: make_df_indexed("Target Store")
+            ),
+            lambda: cached_benchmark_aggregate(
+                'indexed_metrics', 'sales_gp_units', benchmark_key, ("Benchmark Group",) + filter_params, lambda: make_df_indexed("Benchmark Group")
+            )
+        )
+        df_store_sales_idx = select_indexed_metric(df_store_indexed, metric, metric_renamed)
+        df_store_sales_idx_cumsum = select_indexed_metric(df_store_indexed, metric, metric_renamed, cumsum=True)
+        df_benchmark_sales_idx = select_indexed_metric(df_benchmark_indexed, metric, metric_renamed)
+        df_benchmark_sales_idx_cumsum = select_indexed_metric(df_benchmark_indexed, metric, metric_renamed, cumsum=True)
         
         # Make benchmark indexed chart
         st.plotly_chart(indexed_comps_chart(df_store_sales_idx, df_benchmark_sales_idx), use_container_width=True)
 
-        # This is the cumulative sum version of the dataframes indexed on first wk_start_dt
-        df_store_sales_idx_cumsum = create_df_indexed_metric(df_target_store, metric, metric_renamed, st_ss_agg_method, cumsum=True)    
-        df_benchmark_sales_idx_cumsum = create_df_indexed_metric(df_benchmark_stores, metric, metric_renamed, st_ss_agg_method, cumsum=True)
-
         # Make benchmark cumulative indexed chart
         st.plotly_chart(indexed_comps_chart(df_store_sales_idx_cumsum, df_benchmark_sales_idx_cumsum), use_container_width=True)
 
+        # Make target store percentile rank chart - every measure at once, so the ranks don't depend on the measure or aggregation mode
+        df_percentile_ranks = cached_benchmark_aggregate(
+            'percentile_ranks',
+            'sales_gp_units',
+            benchmark_key,
+            (
+                st.session_state['target_address_id'], st.session_state['promotion_ind'], st.session_state['sales_type'],
+                st.session_state['category_type'], tuple(st.session_state['dept_filter']),
+                st.session_state['start_dt'], st.session_state['end_dt']
+            ),
+            lambda: make_df_percentile_ranks(target_totals, benchmark_totals, SALES_MEASURES)
+        )
+        st.plotly_chart(percentile_rank_chart(df_percentile_ranks, metric, metric_renamed), use_container_width=True)
+
         # Make Sales per sqm bubble chart
-        st.plotly_chart(store_bubble_chart(df_target_store, df_benchmark_stores, df_stores, metric, metric_renamed), use_container_width=True)
+        st.plotly_chart(
+            store_bubble_chart(
+                store_week_totals.monthly_sums(metric), st.session_state['target_address_id'], store_index, metric, metric_renamed,
+                max_months=BUBBLE_CHART_MONTHS[st.session_state['bubble_chart_months']]
+            ),
+            use_container_width=True
+        )
         
         # with st.expander(label="View/Download Data", expanded=False):
         #     st.dataframe(df_input, use_container_width=True)
@@ -3,6 +3,8 @@ import plotly.express as px
 import streamlit as st
 from streamlit_option_menu import option_menu
 from charts.shelf_price_idx_charts import *
+from data_loaders.benchmark_cache import benchmark_set_key, cached_benchmark_aggregate
+from data_loaders.registry import load_stores_data
 from datetime import datetime
 
 
@@ -34,28 +36,18 @@ def render_page():
     """
     Add target store address id with benchmark address ids to get the complete list of 
     address ids needed. Use set(list(x)) to remove duplicates in the event target store 
-    is included in the benchmark. This list is then used as a filter in the read_parquet 
-    function. Finally, Split into target and benchmark dataframes.
+    is included in the benchmark. This list is then passed to load_stores_data(), which 
+    returns those stores' rows from the cached per-store blocks. Finally, Split into 
+    target and benchmark dataframes.
     """
     address_list = list(set(st.session_state['benchmark_address_ids']))
     address_list.append(st.session_state['target_address_id'])
     address_list = list(set(address_list))
     
-    datasource = r"data/sales_profile_weekly.parquet"
-    
-    address_filter = [('address_id', 'in', address_list)]
-    
-    @st.cache_data
-    def load_data(data, address_filter):
-        return pd.read_parquet(data, filters=address_filter)
-    
     # ---------------------------- Initialize Dataframes ---------------------------- #
-    data = load_data(datasource, address_filter)
-    data['prom_mth_yr_dt'] = pd.to_datetime(data['prom_month_nm'].astype(str) + data['prom_year_num'].astype(str), format='%B%Y')
-    data['lped_qtr_yr_dt'] = data['lped_qtr_nm'].str[:2] + '-' + data['lped_year_num'].astype(str)
-    data['prom_wk_end_dt'] = pd.to_datetime(data['prom_wk_end_dt']).dt.date
-    min_dt = min(data['prom_wk_end_dt'])
-    max_dt = max(data['prom_wk_end_dt'])
+    data = load_stores_data('sales_profile', address_list)
+    min_dt = data['prom_wk_end_dt'].min().date()
+    max_dt = data['prom_wk_end_dt'].max().date()
     if 'sales_profile_start_dt' not in st.session_state:
         st.session_state['sales_profile_start_dt'] = min_dt
     if 'sales_profile_end_dt' not in st.session_state:
@@ -155,8 +147,9 @@ def render_page():
                 on_change=end_dt_callback
             )
         
-        df_target_store = df_target_store[df_target_store['prom_wk_end_dt'].between(st.session_state['sales_profile_start_dt'], st.session_state['sales_profile_end_dt'])]
-        df_benchmark_stores = df_benchmark_stores[df_benchmark_stores['prom_wk_end_dt'].between(st.session_state['sales_profile_start_dt'], st.session_state['sales_profile_end_dt'])]
+        start_dt, end_dt = pd.Timestamp(st.session_state['sales_profile_start_dt']), pd.Timestamp(st.session_state['sales_profile_end_dt'])
+        df_target_store = df_target_store[df_target_store['prom_wk_end_dt'].between(start_dt, end_dt)]
+        df_benchmark_stores = df_benchmark_stores[df_benchmark_stores['prom_wk_end_dt'].between(start_dt, end_dt)]
         
         
         media_plc_options = df_benchmark_stores['media_plc'].sort_values(ascending=True).unique().tolist()
@@ -183,8 +176,8 @@ def render_page():
         METRIC = METRIC_COL_DICT[st.session_state["measure_type"]]
 
         def make_df_synoptics(df, synoptic_periodicity):
-            df = df.groupby(['media_plc', PERIOD])[['sales_ex_gst', 'gp_ex_gst', 'sales_qty']].sum().reset_index()
-            df_total = df.groupby([PERIOD])[['sales_ex_gst', 'gp_ex_gst', 'sales_qty']].sum().reset_index()
+            df = df.groupby(['media_plc', PERIOD], observed=True)[['sales_ex_gst', 'gp_ex_gst', 'sales_qty']].sum().reset_index()
+            df_total = df.groupby([PERIOD], observed=True)[['sales_ex_gst', 'gp_ex_gst', 'sales_qty']].sum().reset_index()
             df_total = df_total.rename(columns={'sales_ex_gst': 'total_sales_ex_gst', 'gp_ex_gst': 'total_gp_ex_gst', 'sales_qty': 'total_sales_qty'})
             df = pd.merge(df, df_total, on=PERIOD, how='inner')
             df['sales_ex_gst_pct_total'] = df['sales_ex_gst'] / df['total_sales_ex_gst']
@@ -193,8 +186,20 @@ def render_page():
             return df
 
         
-        df_target_store = make_df_synoptics(df_target_store, st.session_state["synoptic_periodicity"])
-        df_benchmark_stores = make_df_synoptics(df_benchmark_stores, st.session_state["synoptic_periodicity"])
+        benchmark_key = benchmark_set_key(st.session_state['benchmark_address_ids'])
+        filter_params = (
+            st.session_state['target_address_id'], st.session_state["synoptic_periodicity"], st.session_state['promotion_ind'],
+            st.session_state['sales_profile_start_dt'], st.session_state['sales_profile_end_dt'], 
+            tuple(st.session_state['media_plc_filter'])
+        )
+        df_target_store = cached_benchmark_aggregate(
+            'synoptics', 'sales_profile', benchmark_key, ("Target Store",) + filter_params,
+            lambda: make_df_synoptics(df_target_store, st.session_state["synoptic_periodicity"])
+        )
+        df_benchmark_stores = cached_benchmark_aggregate(
+            'synoptics', 'sales_profile', benchmark_key, ("Benchmark Group",) + filter_params,
+            lambda: make_df_synoptics(df_benchmark_stores, st.session_state["synoptic_periodicity"])
+        )
 
 
         def stacked_bar_chart(df):
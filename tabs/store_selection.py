@@ -1,19 +1,13 @@
-import pandas as pd
 import streamlit as st
 from st_aggrid import AgGrid, ColumnsAutoSizeMode, GridOptionsBuilder, AgGridTheme, DataReturnMode
 from st_aggrid.shared import GridUpdateMode
+from data_loaders.store_index import load_store_index
 
 
 def render_page():
     #Loading all data upon initialization
-    @st.cache_data(show_spinner=False)
-    def load_store_attributes():
-        df_store_attrs = pd.read_parquet(r'data/store_attributes_weekly.parquet')
-        df_store_attrs = df_store_attrs.sort_values('prom_wk_end_dt', ascending=False)
-        df_store_attrs = df_store_attrs.drop_duplicates('address_id', keep='first')
-        return df_store_attrs
-
-    df_stores = load_store_attributes()
+    store_index = load_store_index()
+    df_stores = store_index.df_stores
 
     # ------------------- Top of Page ------------------- #
     st.markdown("## **Store Selector 🛠️** ##")
@@ -24,8 +18,7 @@ def render_page():
         """
     )
 
-    selectbox_store_nm_list = df_stores['Store Name'].unique().tolist()
-    selectbox_store_nm_list.insert(0, "")
+    selectbox_store_nm_list = [""] + store_index.store_nms
 
     if 'store_nm_selected' not in st.session_state:
         st.session_state['store_nm_selected'] = ""
@@ -38,7 +31,7 @@ def render_page():
         print(f"*** NEW STORE SELECTION: {st.session_state['new_store_nm']} ***")
 
     st.selectbox(
-        label=f"**Select Store** - _({len(df_stores['Store Name'].unique())} total)_", 
+        label=f"**Select Store** - _({len(store_index.store_nms)} total)_", 
         options=selectbox_store_nm_list, 
         index=selectbox_store_nm_list.index(st.session_state['store_nm_selected']),
         key='new_store_nm',
@@ -46,47 +39,46 @@ def render_page():
         )
     
     if st.session_state['store_nm_selected'] != "":
-        df_selected_store = df_stores[df_stores['Store Name'] == st.session_state['store_nm_selected']]
-        target_store_info = df_selected_store.to_dict(orient='records')
+        target_store_info = store_index.store_record(st.session_state['store_nm_selected'])
         
         if 'target_address_id' not in st.session_state:
-            st.session_state['target_address_id'] = target_store_info[0]['address_id']
+            st.session_state['target_address_id'] = target_store_info['address_id']
 
         if 'target_store_state' not in st.session_state:
-            st.session_state['target_store_state'] = target_store_info[0]['State']
+            st.session_state['target_store_state'] = target_store_info['State']
 
         if 'target_store_chanzfp' not in st.session_state:
-            st.session_state['target_store_chanzfp'] = target_store_info[0]['CHAN+ZFP']
+            st.session_state['target_store_chanzfp'] = target_store_info['CHAN+ZFP']
 
 
         st.write(
             f"""
             Benchmark will be constructed using : 
             
-            **State :**  {df_selected_store['State'].values[0]} &emsp;&emsp;&emsp;
-            **Channel & Zone :** {df_selected_store['CHAN+ZFP'].values[0]}
+            **State :**  {target_store_info['State']} &emsp;&emsp;&emsp;
+            **Channel & Zone :** {target_store_info['CHAN+ZFP']}
             """
             )
         with st.expander(label='_View store details_', expanded=False):
             st.write(
                 f"""
-                **Store ID :** {target_store_info[0]['address_id']} &emsp;&emsp;&emsp;
+                **Store ID :** {target_store_info['address_id']} &emsp;&emsp;&emsp;
 
-                **Store Name :** {target_store_info[0]['Store Name']} &emsp;&emsp;&emsp;
+                **Store Name :** {target_store_info['Store Name']} &emsp;&emsp;&emsp;
 
-                **State :** {target_store_info[0]['State']} &emsp;&emsp;&emsp;
+                **State :** {target_store_info['State']} &emsp;&emsp;&emsp;
                 
-                **Channel & Zone :** {target_store_info[0]['CHAN+ZFP']} &emsp;&emsp;&emsp;
+                **Channel & Zone :** {target_store_info['CHAN+ZFP']} &emsp;&emsp;&emsp;
                 
-                **Location :** {target_store_info[0]['store_address']} &emsp;&emsp;&emsp;
+                **Location :** {target_store_info['store_address']} &emsp;&emsp;&emsp;
                 
-                **Store Owner :** {target_store_info[0]['Store Owner']} &emsp;&emsp;&emsp;
+                **Store Owner :** {target_store_info['Store Owner']} &emsp;&emsp;&emsp;
                 
-                **Store Size :** {target_store_info[0]['Store Size']}sqm
+                **Store Size :** {target_store_info['Store Size']}sqm
                 
-                **Subsidy Program 1 :** {target_store_info[0]['Subsidy Program 1']} &emsp;&emsp;&emsp;
+                **Subsidy Program 1 :** {target_store_info['Subsidy Program 1']} &emsp;&emsp;&emsp;
                 
-                **Subsidy Program 2 :** {target_store_info[0]['Subsidy Program 2']} &emsp;&emsp;&emsp;
+                **Subsidy Program 2 :** {target_store_info['Subsidy Program 2']} &emsp;&emsp;&emsp;
                 """
             )
         st.write("---")
@@ -117,10 +109,7 @@ def render_page():
         )
 
         if st.session_state["benchmark_type"] == "Default":
-            df_benchmark_stores = df_stores[
-                (df_stores["State"] == target_store_info[0]["State"]) &
-                (df_stores["CHAN+ZFP"] == target_store_info[0]["CHAN+ZFP"])
-            ]
+            df_benchmark_stores = store_index.stores_in_state_chanzfp(target_store_info["State"], target_store_info["CHAN+ZFP"])
 
             col1, col2, = st.columns(2)
 
@@ -298,6 +287,7 @@ def render_page():
         # st.session_state['selected_row_indexes'] = [row['_selectedRowNodeInfo']['nodeRowIndex'] for row in st.session_state['new_row_selection']['selected_rows']]
         # st.session_state['selected_row_indexes'] = [row['_selectedRowNodeInfo']['nodeRowIndex'] for row in grid_data['selected_rows']]
 
-        st.session_state["benchmark_address_ids"] = [row["address_id"] for row in grid_data["selected_rows"]]
+        # Sorted so the same benchmark group always produces the same list, whatever order the grid returns
+        st.session_state["benchmark_address_ids"] = sorted(row["address_id"] for row in grid_data["selected_rows"])
         st.markdown(f"**_{len(st.session_state['benchmark_address_ids'])} stores in benchmark group_**")
 